@@ -36,7 +36,7 @@ def create_app():
     try:
         CORS(
             app,
-            resources={r"/*": {"origins": allowed_origins, "methods": ["GET", "POST", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"]}},
+            resources={r"/*": {"origins": allowed_origins, "methods": ["GET", "POST", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization", "X-Requested-With", "Range"], "expose_headers": ["Accept-Ranges", "Content-Range", "Content-Length", "ETag"]}},
             supports_credentials=False,
         )
     except Exception:
@@ -53,11 +53,31 @@ def create_app():
                 vary = resp.headers.get("Vary")
                 resp.headers["Vary"] = (vary + ", Origin") if vary else "Origin"
                 resp.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
-                resp.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
+                resp.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With, Range"
+                # PDF.js reads these for partial (Range) loading of /files
+                resp.headers["Access-Control-Expose-Headers"] = "Accept-Ranges, Content-Range, Content-Length, ETag"
         except Exception:
             pass
         return resp
 
+    # gzip/brotli for large JSON/text bodies (RESPONSE_COMPRESSION=0 disables; e.g. /upload payloads)
+    if (os.getenv("RESPONSE_COMPRESSION", "1") or "1").strip().lower() not in {"0", "false", "no", "off"}:
+        try:
+            from .services.compression import compress_response  # type: ignore
+        except Exception:
+            from services.compression import compress_response  # type: ignore
+        try:
+            min_bytes = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024") or 1024)
+        except Exception:
+            min_bytes = 1024
+
+        @app.after_request
+        def compress_large_responses(resp):
+            try:
+                return compress_response(resp, request.accept_encodings, min_bytes=min_bytes)
+            except Exception:
+                return resp
+
     # Ensure JSON errors so after_request can attach CORS headers
     @app.errorhandler(Exception)
     def handle_any_error(e):
@@ -69,6 +89,13 @@ def create_app():
             code = int(getattr(e, 'code', 500) or 500)
             desc = str(getattr(e, 'description', '')) or str(e)
             return {"error": desc}, code
+        try:
+            from .services.rate_limit import RateLimitExceeded  # type: ignore
+        except Exception:
+            from services.rate_limit import RateLimitExceeded  # type: ignore
+        if isinstance(e, RateLimitExceeded):
+            # Local limiter would have had to wait past max_wait; the client retries later
+            return {"error": str(e), "retryAfter": round(e.retry_after, 1)}, 429, {"Retry-After": str(int(e.retry_after) + 1)}
         return {"error": str(e)}, 500
 
     # Registrera routes via blueprints
@@ -104,6 +131,10 @@ def create_app():
         from .routes.tools import tools_bp  # type: ignore
     except Exception:
         from routes.tools import tools_bp  # type: ignore
+    try:
+        from .routes.jobs import jobs_bp  # type: ignore
+    except Exception:
+        from routes.jobs import jobs_bp  # type: ignore
 
     app.register_blueprint(chat_bp)
     app.register_blueprint(upload_bp)
@@ -113,6 +144,7 @@ def create_app():
     app.register_blueprint(summarize_bp)
     app.register_blueprint(sliding_bp)
     app.register_blueprint(tools_bp)
+    app.register_blueprint(jobs_bp)
     return app
 
 
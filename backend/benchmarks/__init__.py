@@ -0,0 +1 @@
+"""Micro-benchmarks for backend services. Run from backend/: python -m benchmarks.<name>"""
@@ -0,0 +1,79 @@
+"""Lookup throughput of EmbeddingCache for 10k/100k keys.
+
+Usage (from backend/):
+    python -m benchmarks.bench_embedding_cache [--sizes 10000 100000] [--dim 3072] [--threads 4]
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from services.embedding_cache import EmbeddingCache
+
+
+def _fill(cache: EmbeddingCache, n: int, dim: int, batch: int = 1000):
+    vec = [random.random() for _ in range(dim)]
+    for j in range(0, n, batch):
+        cache.put_many([(f"k{i}", vec) for i in range(j, min(n, j + batch))], dim)
+
+
+def _lookup(cache: EmbeddingCache, keys, batch: int) -> int:
+    hits = 0
+    for j in range(0, len(keys), batch):
+        hits += len(cache.get_many(keys[j:j + batch]))
+    return hits
+
+
+def run(sizes, dim: int, threads: int, batch: int):
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = EmbeddingCache(os.path.join(tmp, "bench.sqlite3"))
+            t0 = time.perf_counter()
+            _fill(cache, n, dim)
+            fill_s = time.perf_counter() - t0
+            keys = [f"k{i}" for i in range(n)]
+            random.shuffle(keys)
+
+            # Single call with every key (exercises the chunked IN sub-queries)
+            t0 = time.perf_counter()
+            hits = len(cache.get_many(keys))
+            one_s = time.perf_counter() - t0
+
+            # Concurrent readers, each on its own per-thread WAL connection
+            parts = [keys[i::threads] for i in range(threads)]
+            counts = [0] * threads
+
+            def _reader(i: int):
+                counts[i] = _lookup(cache, parts[i], batch)
+                cache.close()
+
+            ts = [threading.Thread(target=_reader, args=(i,)) for i in range(threads)]
+            t0 = time.perf_counter()
+            for t in ts:
+                t.start()
+            for t in ts:
+                t.join()
+            par_s = time.perf_counter() - t0
+            cache.close()
+            print(
+                f"n={n:>7} dim={dim} fill={fill_s:.2f}s "
+                f"get_many(all)={one_s:.3f}s ({hits / one_s:,.0f} keys/s) "
+                f"{threads} threads x batch {batch}={par_s:.3f}s ({sum(counts) / par_s:,.0f} keys/s)"
+            )
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--batch", type=int, default=256)
+    args = ap.parse_args()
+    run(args.sizes, args.dim, args.threads, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Token-budgeted batch packing: previous first-fit scan vs pack_token_batches (best-fit + bisect).
+
+Usage (from backend/):
+    python -m benchmarks.bench_packing [--sizes 10000 100000] [--budget 8000] [--batch-size 256]
+"""
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from services.embeddings import pack_token_batches
+
+
+def legacy_ffd(items, max_tokens: int, batch_size: int):
+    """The original O(n * batches) first-fit decreasing loop, kept here for comparison."""
+    batches = []
+    batch_tokens = []
+    for i, t, tok in sorted(items, key=lambda x: x[2], reverse=True):
+        placed = False
+        for b_idx in range(len(batches)):
+            if batch_tokens[b_idx] + tok <= max_tokens and len(batches[b_idx]) < batch_size:
+                batches[b_idx].append((i, t))
+                batch_tokens[b_idx] += tok
+                placed = True
+                break
+        if not placed:
+            batches.append([(i, t)])
+            batch_tokens.append(tok)
+    out = []
+    for b in batches:
+        for j in range(0, len(b), batch_size):
+            out.append(b[j:j + batch_size])
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--budget", type=int, default=8000)
+    ap.add_argument("--batch-size", type=int, default=256)
+    ap.add_argument("--legacy-max", type=int, default=20_000, help="skip the quadratic baseline above this size")
+    args = ap.parse_args()
+    rng = random.Random(0)
+    for n in args.sizes:
+        # Chunk sizes roughly like chunk_text output: mostly near the window, some short tails
+        items = [(i, "", rng.choice([rng.randint(700, 800), rng.randint(20, 400)])) for i in range(n)]
+        t0 = time.perf_counter()
+        new = pack_token_batches(items, args.budget, args.batch_size)
+        new_s = time.perf_counter() - t0
+        line = f"n={n:>7} best-fit: {new_s * 1000:8.1f} ms, {len(new)} batches"
+        if n <= args.legacy_max:
+            t0 = time.perf_counter()
+            old = legacy_ffd(items, args.budget, args.batch_size)
+            old_s = time.perf_counter() - t0
+            line += f" | legacy first-fit: {old_s * 1000:8.1f} ms, {len(old)} batches ({old_s / max(new_s, 1e-9):.0f}x)"
+        else:
+            line += " | legacy first-fit: skipped"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
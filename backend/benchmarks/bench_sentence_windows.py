@@ -0,0 +1,123 @@
+"""Sentence window chunking: previous recounting loop vs pdf_extractor.pages_to_chunks (prefix sums).
+
+Uses tiktoken when it is installed, otherwise the whitespace fallback counter.
+
+Usage (from backend/):
+    python -m benchmarks.bench_sentence_windows [--pages 300] [--sentences 40] [--max-tokens 900]
+"""
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from services.pdf_extractor import Page, pages_to_chunks, rolling_window_sentences, split_sentences
+from services.tokenizer import count_tokens
+
+
+def legacy_rolling_window(sentences, max_tokens: int, overlap: int, count_tokens):
+    """The original loop that recounts tail sentences and the whole tail on every break."""
+    if not sentences:
+        return []
+    chunks = []
+    cur = []
+    cur_tok = 0
+    for s in sentences:
+        t = max(1, count_tokens(s))
+        if cur and cur_tok + t > max_tokens:
+            chunks.append(" ".join(cur))
+            if overlap > 0:
+                tail = []
+                tail_tok = 0
+                for seg in reversed(cur):
+                    tt = max(1, count_tokens(seg))
+                    if tail_tok + tt > overlap:
+                        break
+                    tail.append(seg)
+                    tail_tok += tt
+                cur = list(reversed(tail))
+                cur_tok = sum(max(1, count_tokens(seg)) for seg in cur)
+            else:
+                cur = []
+                cur_tok = 0
+        cur.append(s)
+        cur_tok += t
+    if cur:
+        chunks.append(" ".join(cur))
+    return chunks
+
+
+def legacy_pages_to_chunks(pages, count_tokens, min_tokens=500, max_tokens=900, overlap_ratio=0.12):
+    overlap = int(max_tokens * max(0.0, min(0.5, overlap_ratio)))
+    chunks = []
+    idx = 0
+    for pg in pages:
+        pieces = legacy_rolling_window(split_sentences(pg.text), max_tokens, overlap, count_tokens)
+        for piece in pieces:
+            if count_tokens(piece) < min_tokens and chunks:
+                prev_txt, prev_meta = chunks[-1]
+                merged = prev_txt + "\n\n" + piece
+                if count_tokens(merged) <= max_tokens + overlap:
+                    chunks[-1] = (merged, prev_meta)
+                    continue
+            chunks.append((piece, {"page": pg.page, "idx": idx}))
+            idx += 1
+    return chunks
+
+
+def make_pages(n_pages: int, n_sentences: int, rng: random.Random):
+    words = "föreläsning modell data analys tentamen metod resultat teori exempel Kapitel figur".split()
+    pages = []
+    for p in range(n_pages):
+        sents = []
+        for _ in range(n_sentences):
+            body = " ".join(rng.choice(words) for _ in range(rng.randint(6, 40)))
+            sents.append(body[0].upper() + body[1:] + rng.choice([".", "!", "?"]))
+        pages.append(Page(page=p + 1, text=" ".join(sents)))
+    return pages
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--pages", type=int, default=300)
+    ap.add_argument("--sentences", type=int, default=40, help="sentences per page")
+    ap.add_argument("--max-tokens", type=int, default=900)
+    ap.add_argument("--overlap-ratio", type=float, default=0.12)
+    args = ap.parse_args()
+    pages = make_pages(args.pages, args.sentences, random.Random(0))
+
+    calls = [0]
+
+    def counting(text: str) -> int:
+        calls[0] += 1
+        return count_tokens(text)
+
+    t0 = time.perf_counter()
+    old = legacy_pages_to_chunks(pages, counting, max_tokens=args.max_tokens, overlap_ratio=args.overlap_ratio)
+    old_s = time.perf_counter() - t0
+    old_calls, calls[0] = calls[0], 0
+
+    t0 = time.perf_counter()
+    new = pages_to_chunks(pages, counting, max_tokens=args.max_tokens, overlap_ratio=args.overlap_ratio)
+    new_s = time.perf_counter() - t0
+    new_calls = calls[0]
+
+    t0 = time.perf_counter()
+    pages_to_chunks(pages, max_tokens=args.max_tokens, overlap_ratio=args.overlap_ratio)
+    batch_s = time.perf_counter() - t0
+
+    # Window boundaries must be identical; only the min_tokens merge decisions may differ,
+    # since merged sizes are now summed instead of re-tokenized
+    overlap = int(args.max_tokens * args.overlap_ratio)
+    same = all(
+        legacy_rolling_window(split_sentences(pg.text), args.max_tokens, overlap, count_tokens)
+        == rolling_window_sentences(split_sentences(pg.text), args.max_tokens, overlap, count_tokens)
+        for pg in pages
+    )
+    print(f"pages={args.pages} sentences/page={args.sentences} windows identical: {same}")
+    print(f"legacy:          {old_s * 1000:8.1f} ms, {old_calls:>7} tokenizer calls, {len(old)} chunks")
+    print(f"prefix sums:     {new_s * 1000:8.1f} ms, {new_calls:>7} tokenizer calls, {len(new)} chunks")
+    print(f"prefix + batch:  {batch_s * 1000:8.1f} ms ({old_s / max(batch_s, 1e-9):.1f}x vs legacy)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""InMemoryVectorStore query latency: previous pure-Python scan vs the NumPy matrix store.
+
+The legacy store keeps float lists and scores every document with _cosine plus a full sort;
+it is only run up to --legacy-max documents (at 100k x 3072 the float lists alone need ~10 GB).
+
+Usage (from backend/):
+    python -m benchmarks.bench_vector_store [--sizes 1000 10000 100000] [--dim 3072] [--queries 20] [--batch 32]
+"""
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+
+from services.vector_store import InMemoryVectorStore, VectorDoc, _cosine
+
+
+class LegacyVectorStore:
+    """The original store: Python lists, norms recomputed per pair, full sort per query."""
+
+    def __init__(self):
+        self._docs = []
+
+    def upsert(self, docs):
+        existing = {d.id: i for i, d in enumerate(self._docs)}
+        for d in docs:
+            idx = existing.get(d.id)
+            if idx is None:
+                existing[d.id] = len(self._docs)
+                self._docs.append(d)
+            else:
+                self._docs[idx] = d
+
+    def query(self, embedding, top_k=5):
+        scores = [(_cosine(embedding, d.embedding), d) for d in self._docs]
+        scores.sort(key=lambda t: t[0], reverse=True)
+        return [(d, s) for s, d in scores[: max(1, top_k)]]
+
+
+def _fill(store, vectors: np.ndarray, batch: int = 1000) -> float:
+    """Upsert in embedding-API-sized batches of float lists; returns seconds."""
+    t0 = time.perf_counter()
+    for j in range(0, len(vectors), batch):
+        rows = vectors[j:j + batch].tolist()
+        store.upsert([VectorDoc(id=f"d{j + i}", text="", embedding=r) for i, r in enumerate(rows)])
+    return time.perf_counter() - t0
+
+
+def _per_query_ms(fn, queries) -> float:
+    t0 = time.perf_counter()
+    fn(queries)
+    return (time.perf_counter() - t0) * 1000 / len(queries)
+
+
+def run(sizes, dim: int, n_queries: int, batch: int, top_k: int, legacy_max: int, storages):
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((n_queries, dim), dtype=np.float32).tolist()
+    print(f"dim={dim} top_k={top_k} queries={n_queries} batch={batch}")
+    for n in sizes:
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        print(f"\n{n} docs")
+        ref = None
+        if n <= legacy_max:
+            legacy = LegacyVectorStore()
+            fill_s = _fill(legacy, vectors)
+            ms = _per_query_ms(lambda qs: [legacy.query(q, top_k) for q in qs], queries)
+            ref = [[d.id for d, _ in legacy.query(q, top_k)] for q in queries[:5]]
+            print(f"  legacy python       upsert {fill_s:7.2f} s   query {ms:9.2f} ms")
+            del legacy
+        else:
+            print("  legacy python       skipped (--legacy-max)")
+        for storage in storages:
+            store = InMemoryVectorStore(dim, storage=storage)
+            fill_s = _fill(store, vectors)
+            single = _per_query_ms(lambda qs: [store.query(q, top_k) for q in qs], queries)
+            batched = _per_query_ms(
+                lambda qs: [store.query_many(qs[i:i + batch], top_k) for i in range(0, len(qs), batch)], queries
+            )
+            line = f"  numpy {storage:<8}      upsert {fill_s:7.2f} s   query {single:9.2f} ms   batched {batched:7.2f} ms/query"
+            if ref is not None:
+                got = [[d.id for d, _ in store.query(q, top_k)] for q in queries[:5]]
+                overlap = sum(len(set(a) & set(b)) for a, b in zip(ref, got)) / (len(ref) * top_k)
+                line += f"   recall@{top_k} {overlap:.3f}"
+            print(line)
+            # Release the matrix before the next storage mode is filled (the lambdas above
+            # close over `store`, so rebind rather than del)
+            store = None
+        del vectors
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--queries", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=32, help="queries per query_many call")
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--legacy-max", type=int, default=10000)
+    ap.add_argument("--storage", nargs="+", default=["float32", "int8"], help="storage modes to time")
+    args = ap.parse_args()
+    run(args.sizes, args.dim, args.queries, args.batch, args.top_k, args.legacy_max, args.storage)
+
+
+if __name__ == "__main__":
+    main()
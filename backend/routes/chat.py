@@ -9,6 +9,12 @@ except Exception:
     OpenAI = None  # type: ignore
 
 
+try:
+    from services.rate_limit import RateLimitExceeded, estimate_chat_tokens, throttle  # type: ignore
+except Exception:
+    from backend.services.rate_limit import RateLimitExceeded, estimate_chat_tokens, throttle  # type: ignore
+
+
 chat_bp = Blueprint("chat", __name__)
 
 
@@ -118,6 +124,7 @@ def chat():
             payload["tools"] = tools_arg
         if tool_choice:
             payload["tool_choice"] = tool_choice
+        throttle(api_key, mdl, estimate_chat_tokens(payload["messages"], max_tokens))
         return client.chat.completions.create(**payload)
 
     try:
@@ -129,9 +136,13 @@ def chat():
             try:
                 resp = _invoke(fb, messages, tools)
                 model = fb
+            except RateLimitExceeded:
+                raise
             except Exception as e2:
                 return jsonify({"error": str(e2)}), 400
         else:
+            if isinstance(e, RateLimitExceeded):
+                raise
             return jsonify({"error": str(e)}), 400
 
     # Handle a single tool call round if present
@@ -358,6 +369,7 @@ def chat_stream():
         # Emit an initial meta frame (bytes)
         yield (json.dumps({"type": "meta", "model": final_model}, ensure_ascii=False) + "\n").encode("utf-8")
         try:
+            throttle(api_key, final_model, estimate_chat_tokens(messages, max_tokens))
             stream = client.chat.completions.create(
                 model=final_model,
                 messages=messages,
@@ -463,6 +475,7 @@ def chat_stream():
             if fb and fb != final_model:
                 yield (json.dumps({"type": "meta", "note": "fallback", "model": fb}, ensure_ascii=False) + "\n").encode("utf-8")
                 try:
+                    throttle(api_key, fb, estimate_chat_tokens(messages, max_tokens))
                     stream = client.chat.completions.create(
                         model=fb,
                         messages=messages,
@@ -53,3 +53,21 @@ def key_status():
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@debug_bp.get("/debug/embedding-cache")
+def embedding_cache_stats():
+    """Rader, bytes, evictions och LRU-träffar för embedding-cachen. ?maintain=1 kör underhåll direkt."""
+    try:
+        try:
+            from services.embedding_cache import get_shared_cache  # type: ignore
+        except Exception:
+            from backend.services.embedding_cache import get_shared_cache  # type: ignore
+        cache = get_shared_cache()
+        out = {}
+        if (request.args.get("maintain") or "").lower() in {"1", "true", "yes"}:
+            out["maintenance"] = cache.maintain()
+        out.update(cache.stats())
+        return jsonify(out)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -6,6 +6,11 @@ try:
 except Exception:
     PdfReader = None  # type: ignore
 
+try:
+    from services.extraction_cache import cached_extract_pages  # type: ignore
+except Exception:
+    cached_extract_pages = None  # type: ignore
+
 exam_bp = Blueprint("exam", __name__)
 
 
@@ -13,15 +18,19 @@ def _extract_text(filename: str, stream: bytes) -> str:
     name = (filename or "").lower()
     if name.endswith(".pdf"):
         try:
-            import pdfplumber
-            with pdfplumber.open(io.BytesIO(stream)) as pdf:
-                parts = []
-                for page in pdf.pages:
-                    t = page.extract_text()
-                    if t:
-                        parts.append(t)
-                if parts:
-                    return "\n\n".join(parts).strip()
+            if cached_extract_pages is not None:
+                # Same pdfplumber text; cached by content and split across processes for large PDFs
+                parts = [p.text for p in cached_extract_pages(stream, engine="pdfplumber", clean=False) if p.text]
+            else:
+                import pdfplumber
+                with pdfplumber.open(io.BytesIO(stream)) as pdf:
+                    parts = []
+                    for page in pdf.pages:
+                        t = page.extract_text()
+                        if t:
+                            parts.append(t)
+            if parts:
+                return "\n\n".join(parts).strip()
         except Exception:
             pass
         try:
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from services.jobs import DONE, ERROR, get_job_queue
+
+
+jobs_bp = Blueprint("jobs", __name__)
+
+
+def _stream_max_sec() -> float:
+    """How long one /stream response may run (JOB_STREAM_MAX_SEC, default 50). A streaming
+    response holds a sync gunicorn worker; it must end well before the worker timeout (120 s
+    in the Dockerfile), otherwise gunicorn kills the worker, along with jobs pinned to it."""
+    try:
+        return max(1.0, float(os.getenv("JOB_STREAM_MAX_SEC", "50") or 50))
+    except Exception:
+        return 50.0
+
+
+@jobs_bp.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    """Status för ett bakgrundsjobb (queued/running/done/error), senaste event och resultat när klart."""
+    q = get_job_queue()
+    job = q.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    job["progress"] = q.last_event(job_id)
+    return jsonify(job)
+
+
+@jobs_bp.get("/jobs/<job_id>/stream")
+def job_stream(job_id: str):
+    """NDJSON-progress i samma format som /rag/ingest_stream, hämtad ur jobbkön.
+    Varje event har "seq"; ?after=<seq> återupptar en avbruten ström. Strömmen slutar när jobbet är klart,
+    eller efter JOB_STREAM_MAX_SEC med {type:"progress", stage:"resume", after} – anslut då igen med ?after=.
+    Kort polling av /jobs/<id> är det rekommenderade sättet att följa långa jobb."""
+    q = get_job_queue()
+    if q.get(job_id) is None:
+        return jsonify({"error": "unknown job"}), 404
+    try:
+        after = int(request.args.get("after", "-1"))
+    except Exception:
+        after = -1
+
+    def gen():
+        def send(ev):
+            try:
+                return json.dumps(ev, ensure_ascii=False) + "\n"
+            except Exception:
+                return json.dumps({"type": "error", "error": "encoding"}) + "\n"
+
+        seq = after
+        last_type = None
+        last_emit = time.time()
+        deadline = time.time() + _stream_max_sec()
+        while True:
+            # Read status before events so the final events are never missed
+            job = q.get(job_id)
+            for s, ev in q.events(job_id, after=seq):
+                seq = s
+                ev["seq"] = s
+                last_type = ev.get("type")
+                yield send(ev)
+                last_emit = time.time()
+            if job is None:
+                yield send({"type": "error", "error": "job expired"})
+                return
+            if job["status"] in (DONE, ERROR):
+                # Jobs failed by stale-worker recovery have no error event of their own
+                if job["status"] == ERROR and last_type != ERROR:
+                    yield send({"type": "error", "error": job.get("error") or "failed"})
+                return
+            if time.time() >= deadline:
+                # Free the worker; the client reconnects with ?after=<seq>
+                yield send({"type": "progress", "stage": "resume", "after": seq})
+                return
+            if time.time() - last_emit > 5:
+                yield send({"type": "progress", "stage": "heartbeat"})
+                last_emit = time.time()
+            time.sleep(0.25)
+
+    return Response(stream_with_context(gen()), mimetype="application/x-ndjson")
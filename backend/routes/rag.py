@@ -2,7 +2,7 @@ from __future__ import annotations
 import os
 from typing import List, Tuple, Dict, Any
 import re
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, current_app, jsonify, request, Response
 from flask import stream_with_context
 import json
 import threading
@@ -10,16 +10,44 @@ import queue
 import time
 
 from services.openai_service import get_client
-from services.tokenizer import chunk_text
-from services.embeddings import embed_texts
+from services.rate_limit import estimate_chat_tokens, throttle
+from services.tokenizer import chunk_spans
+from services.near_dup import collapse_near_duplicates
+from services.embeddings import embed_texts, iter_embed_texts, truncate_embedding
 import logging
-from services.vector_store import VectorDoc
-from services.vector_registry import get_store
+from services.vector_store import STORAGE_DTYPES, VectorDoc
+from services.vector_registry import get_dim, get_store
+from services.jobs import register_handler, submit_job
+from werkzeug.utils import safe_join
+
+try:
+    from services.extraction_cache import cached_extract_pages  # type: ignore
+except Exception:
+    cached_extract_pages = None  # type: ignore
 
 
 rag_bp = Blueprint("rag", __name__)
 
 PAGE_RX = re.compile(r"\[Sida\s+(\d+)\]", re.IGNORECASE)
+STORED_PREFIX_RX = re.compile(r"^[0-9a-f]{16}_")
+
+
+def _embedding_dims(data: Dict[str, Any]) -> int | None:
+    """Requested Matryoshka size (embeddingDimensions or EMBEDDING_DIMENSIONS); None = model default."""
+    raw = data.get("embeddingDimensions") or os.getenv("EMBEDDING_DIMENSIONS")
+    try:
+        dims = int(raw) if raw else 0
+    except Exception:
+        dims = 0
+    return dims if dims > 0 else None
+
+
+def _vector_storage_error(data: Dict[str, Any]) -> str | None:
+    """Error message when vectorStorage is set to anything but float32/float16/int8."""
+    raw = data.get("vectorStorage")
+    if raw is None or str(raw).strip().lower() in STORAGE_DTYPES:
+        return None
+    return f"vectorStorage must be one of {', '.join(STORAGE_DTYPES)}"
 
 
 def split_pages(text: str) -> List[Tuple[int, str]]:
@@ -40,9 +68,203 @@ def split_pages(text: str) -> List[Tuple[int, str]]:
     return pages
 
 
+def _near_dup_threshold(data: Dict[str, Any]) -> float:
+    """nearDuplicateThreshold (or RAG_NEAR_DUP_THRESHOLD); opt-in, default 0 keeps every page and chunk."""
+    raw = data.get("nearDuplicateThreshold")
+    if raw is None:
+        raw = os.getenv("RAG_NEAR_DUP_THRESHOLD", "0")
+    try:
+        return max(0.0, min(1.0, float(raw or 0)))
+    except Exception:
+        return 0.0
+
+
+def _chunk_pages(
+    pages: List[Tuple[int, str]], bilaga: str, chunk_tokens: int, overlap: int, near_dup: float = 0.0
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Chunk each page by token windows; metadata records the span within the page text
+    (start/end character offsets) and its token count.
+
+    With `near_dup` > 0, near-identical pages (slide build-ups, repeated instructions) are
+    collapsed before chunking and near-identical chunks before embedding; the kept one lists
+    every page it stands in for under "sidor".
+    """
+    covers: Dict[int, List[int]] = {}
+    if near_dup > 0 and len(pages) > 1:
+        by_idx = dict(enumerate(pages))
+        groups = collapse_near_duplicates([(i, body) for i, (_, body) in by_idx.items()], threshold=near_dup)
+        pages = [by_idx[rep] for rep, _ in groups]
+        covers = {by_idx[rep][0]: sorted({by_idx[m][0] for m in members}) for rep, members in groups}
+    chunk_texts: List[str] = []
+    metas: List[Dict[str, Any]] = []
+    for page_no, body in pages:
+        for start, end, n_tokens in chunk_spans(body, max_tokens=chunk_tokens, overlap=overlap, model="cl100k_base"):
+            chunk_texts.append(body[start:end])
+            metas.append({
+                "bilaga": bilaga,
+                "sida": page_no,
+                "sidor": covers.get(page_no, [page_no]),
+                "start": start,
+                "end": end,
+                "tokens": n_tokens,
+            })
+    if near_dup > 0 and len(chunk_texts) > 1:
+        groups = collapse_near_duplicates(list(enumerate(chunk_texts)), threshold=near_dup)
+        kept_texts: List[str] = []
+        kept_metas: List[Dict[str, Any]] = []
+        for rep, members in groups:
+            meta = metas[rep]
+            if len(members) > 1:
+                meta["sidor"] = sorted({p for m in members for p in metas[m]["sidor"]})
+            kept_texts.append(chunk_texts[rep])
+            kept_metas.append(meta)
+        chunk_texts, metas = kept_texts, kept_metas
+    return chunk_texts, metas
+
+
+def _batch_docs(collection: str, idxs: List[int], vecs: List[List[float]], chunk_texts: List[str], metas: List[Dict[str, Any]]) -> List[VectorDoc]:
+    docs: List[VectorDoc] = []
+    for i, v in zip(idxs, vecs):
+        meta = metas[i]
+        doc_id = f"{collection}:{meta.get('bilaga')}:{meta.get('sida')}:{i}"
+        docs.append(VectorDoc(id=doc_id, text=chunk_texts[i], embedding=v, meta=meta))
+    return docs
+
+
+def _index_chunks(
+    data: Dict[str, Any],
+    collection: str,
+    chunk_texts: List[str],
+    metas: List[Dict[str, Any]],
+    emb_model: str,
+    emb_dims: int | None,
+    max_tokens_per_batch: int | None,
+    on_progress=None,
+    on_indexed=None,
+) -> int:
+    """Embed and upsert each batch as it completes so the collection is queryable while
+    ingest runs; returns the number of chunks indexed."""
+    store = None
+    indexed = 0
+    for idxs, vecs in iter_embed_texts(
+        chunk_texts,
+        model=emb_model,
+        on_progress=on_progress,
+        max_tokens_per_batch=max_tokens_per_batch,
+        dimensions=emb_dims,
+    ):
+        if not vecs:
+            continue
+        if store is None:
+            store = get_store(collection, len(vecs[0]), storage=data.get("vectorStorage"))
+        store.upsert(_batch_docs(collection, idxs, vecs, chunk_texts, metas))
+        indexed += len(idxs)
+        if on_indexed is not None:
+            on_indexed(indexed)
+    return indexed
+
+
+def _file_pages(path: str, name: str) -> List[Tuple[int, str]]:
+    """(page, text) for a stored upload: cleaned PDF pages (via the extraction cache) or the whole text file."""
+    if name.lower().endswith(".pdf"):
+        if cached_extract_pages is None:
+            raise RuntimeError("PDF extraction unavailable")
+        return [(p.page, (p.text or "").strip()) for p in cached_extract_pages(path) if (p.text or "").strip()]
+    with open(path, "rb") as fh:
+        return split_pages(fh.read().decode("utf-8", errors="ignore"))
+
+
+def _ingest_job(payload: Dict[str, Any], emit) -> Dict[str, Any]:
+    """Background ingest: extract (stored files) -> chunk -> embed -> index, emitting the
+    same events as /rag/ingest_stream."""
+    data = payload
+    collection = (data.get("collection") or "default").strip()
+    chunk_tokens = int(data.get("chunkTokens", 800))
+    overlap = int(data.get("overlapTokens", 100))
+    emb_model = (data.get("embeddingModel") or "text-embedding-3-large").strip()
+    emb_dims = _embedding_dims(data)
+    try:
+        max_tokens_per_batch = int(data.get("maxTokensPerBatch")) if data.get("maxTokensPerBatch") is not None else None
+    except Exception:
+        max_tokens_per_batch = None
+    near_dup = _near_dup_threshold(data)
+
+    chunk_texts: List[str] = []
+    metas: List[Dict[str, Any]] = []
+    text = (data.get("text") or "").strip()
+    if text:
+        bilaga = (data.get("bilaga") or data.get("name") or "Bilaga").strip()
+        chunk_texts, metas = _chunk_pages(split_pages(text), bilaga, chunk_tokens, overlap, near_dup)
+    files = data.get("files") or []
+    for i, f in enumerate(files):
+        emit({"type": "progress", "stage": "extract", "name": f["name"], "done": i, "total": len(files)})
+        # Stored names carry a content prefix (<sha256[:16]>_<filename>); the bilaga is the original name
+        bilaga = STORED_PREFIX_RX.sub("", f["name"])
+        t, m = _chunk_pages(_file_pages(f["path"], f["name"]), bilaga, chunk_tokens, overlap, near_dup)
+        chunk_texts += t
+        metas += m
+
+    emit({"type": "started", "collection": collection, "chunksPlanned": len(chunk_texts)})
+    if not chunk_texts:
+        emit({"type": "done", "collection": collection, "chunks": 0})
+        return {"collection": collection, "chunks": 0}
+    emit({"type": "scheduled", "collection": collection, "chunks": len(chunk_texts)})
+
+    def _progress(ev):
+        ev = dict(ev) if isinstance(ev, dict) else {"raw": str(ev)}
+        ev["type"] = "progress"
+        emit(ev)
+
+    def _indexed(n):
+        emit({"type": "indexed", "collection": collection, "chunks": n, "partial": n < len(chunk_texts)})
+
+    indexed = _index_chunks(
+        data, collection, chunk_texts, metas, emb_model, emb_dims, max_tokens_per_batch,
+        on_progress=_progress, on_indexed=_indexed,
+    )
+    if not indexed:
+        raise RuntimeError("embedding failed or empty")
+    emit({"type": "done", "collection": collection, "chunks": indexed})
+    return {"collection": collection, "chunks": indexed}
+
+
+# Vector stores live in this process's memory, so ingest jobs are pinned to the process that queued them
+register_handler("rag_ingest", _ingest_job)
+
+
+def _submit_ingest(data: Dict[str, Any]):
+    """Queue a background ingest; `files` are names returned by /upload (served under /files/)."""
+    upload_dir = current_app.config.get("UPLOAD_DIR") or ""
+    files = []
+    for name in data.get("files") or []:
+        path = safe_join(upload_dir, str(name))
+        if not path or not os.path.isfile(path):
+            return jsonify({"error": f"unknown file: {name}"}), 400
+        files.append({"name": str(name), "path": path})
+    if not files and not (data.get("text") or "").strip():
+        return jsonify({"error": "text or files required"}), 400
+    payload = {k: v for k, v in data.items() if k not in {"async", "files"}}
+    payload["files"] = files
+    job_id = submit_job("rag_ingest", payload, pin=True)
+    base_url = (request.host_url or "").rstrip("/")
+    return jsonify({
+        "jobId": job_id,
+        "status": "queued",
+        "statusUrl": f"{base_url}/jobs/{job_id}",
+        "streamUrl": f"{base_url}/jobs/{job_id}/stream",
+    }), 202
+
+
 @rag_bp.post("/rag/ingest")
 def rag_ingest():
+    """Synkron ingest. Med "async": true köas jobbet i stället (även för "files" från /upload)
+    och svaret blir 202 med jobId; följ det via /jobs/<id> eller /jobs/<id>/stream."""
     data = request.get_json(force=True, silent=True) or {}
+    storage_error = _vector_storage_error(data)
+    if storage_error:
+        return jsonify({"error": storage_error}), 400
+    if data.get("async"):
+        return _submit_ingest(data)
     collection = (data.get("collection") or "default").strip()
     text = (data.get("text") or "").strip()
     bilaga = (data.get("bilaga") or data.get("name") or "Bilaga").strip()
@@ -51,6 +273,7 @@ def rag_ingest():
     chunk_tokens = int(data.get("chunkTokens", 800))
     overlap = int(data.get("overlapTokens", 100))
     emb_model = (data.get("embeddingModel") or "text-embedding-3-large").strip()
+    emb_dims = _embedding_dims(data)
     try:
         max_tokens_per_batch = int(data.get("maxTokensPerBatch")) if data.get("maxTokensPerBatch") is not None else None
     except Exception:
@@ -58,13 +281,7 @@ def rag_ingest():
 
     # Split into PDF pages using markers, then chunk per page
     pages = split_pages(text)
-    chunk_texts: List[str] = []
-    metas: List[Dict[str, Any]] = []
-    for page_no, body in pages:
-        chunks = chunk_text(body, max_tokens=chunk_tokens, overlap=overlap, model="cl100k_base")
-        for ch in chunks:
-            chunk_texts.append(ch)
-            metas.append({"bilaga": bilaga, "sida": page_no})
+    chunk_texts, metas = _chunk_pages(pages, bilaga, chunk_tokens, overlap, _near_dup_threshold(data))
 
     if not chunk_texts:
         return jsonify({"chunks": 0, "collection": collection})
@@ -77,30 +294,25 @@ def rag_ingest():
         except Exception:
             pass
 
-    vecs = embed_texts(
-        chunk_texts,
-        model=emb_model,
-        on_progress=_progress,
-        max_tokens_per_batch=max_tokens_per_batch,
+    indexed = _index_chunks(
+        data, collection, chunk_texts, metas, emb_model, emb_dims, max_tokens_per_batch, on_progress=_progress
     )
-    if not vecs:
+    if not indexed:
         return jsonify({"error": "embedding failed"}), 500
-    dim = len(vecs[0])
-    store = get_store(collection, dim)
-    docs: List[VectorDoc] = []
-    for i, (c, v, meta) in enumerate(zip(chunk_texts, vecs, metas)):
-        doc_id = f"{collection}:{meta.get('bilaga')}:{meta.get('sida')}:{i}"
-        docs.append(VectorDoc(id=doc_id, text=c, embedding=v, meta=meta))
-    store.upsert(docs)
-    return jsonify({"chunks": len(docs), "collection": collection})
+    return jsonify({"chunks": indexed, "collection": collection})
 
 
 @rag_bp.post("/rag/ingest_stream")
 def rag_ingest_stream():
     """Streamad ingest som skickar NDJSON-progress medan embeddings körs.
+    Varje färdig batch upsertas direkt, så samlingen går att fråga mot redan under ingest.
     Events: {type:"started"|"scheduled"|"progress"|"indexed"|"done"|"error", ...}
+    "indexed" skickas per batch med löpande antal chunks och partial=true tills allt är klart.
     """
     data = request.get_json(force=True, silent=True) or {}
+    storage_error = _vector_storage_error(data)
+    if storage_error:
+        return jsonify({"error": storage_error}), 400
     collection = (data.get("collection") or "default").strip()
     text = (data.get("text") or "").strip()
     bilaga = (data.get("bilaga") or data.get("name") or "Bilaga").strip()
@@ -109,6 +321,7 @@ def rag_ingest_stream():
     chunk_tokens = int(data.get("chunkTokens", 800))
     overlap = int(data.get("overlapTokens", 100))
     emb_model = (data.get("embeddingModel") or "text-embedding-3-large").strip()
+    emb_dims = _embedding_dims(data)
     try:
         max_tokens_per_batch = int(data.get("maxTokensPerBatch")) if data.get("maxTokensPerBatch") is not None else None
     except Exception:
@@ -116,13 +329,7 @@ def rag_ingest_stream():
 
     # Build chunks upfront (non-streaming)
     pages = split_pages(text)
-    chunk_texts: List[str] = []
-    metas: List[Dict[str, Any]] = []
-    for page_no, body in pages:
-        chunks = chunk_text(body, max_tokens=chunk_tokens, overlap=overlap, model="cl100k_base")
-        for ch in chunks:
-            chunk_texts.append(ch)
-            metas.append({"bilaga": bilaga, "sida": page_no})
+    chunk_texts, metas = _chunk_pages(pages, bilaga, chunk_tokens, overlap, _near_dup_threshold(data))
 
     def gen():
         def send(ev):
@@ -139,7 +346,6 @@ def rag_ingest_stream():
             return
 
         q: "queue.Queue[dict]" = queue.Queue()
-        result_holder: dict = {}
         err_holder: dict = {}
 
         def _progress(ev):
@@ -152,14 +358,15 @@ def rag_ingest_stream():
 
         def _worker():
             try:
-                from services.embeddings import embed_texts as _embed_texts
-                vecs = _embed_texts(
+                for idxs, vecs in iter_embed_texts(
                     chunk_texts,
                     model=emb_model,
                     on_progress=_progress,
                     max_tokens_per_batch=max_tokens_per_batch,
-                )
-                result_holder["vecs"] = vecs
+                    dimensions=emb_dims,
+                ):
+                    # Hand finished batches to the response thread, which owns the store upserts
+                    q.put({"type": "_batch", "idxs": idxs, "vecs": vecs})
             except Exception as e:  # pragma: no cover
                 err_holder["error"] = str(e)
             finally:
@@ -176,11 +383,22 @@ def rag_ingest_stream():
         t = threading.Thread(target=_worker, daemon=True)
         t.start()
 
-        # Drain queue while embedding runs
+        # Drain queue while embedding runs; upsert each batch as soon as it arrives
+        store = None
+        indexed = 0
         last_emit = time.time()
         while t.is_alive() or not q.empty():
             try:
                 ev = q.get(timeout=0.5)
+                if ev.get("type") == "_batch":
+                    vecs = ev.get("vecs") or []
+                    if not vecs:
+                        continue
+                    if store is None:
+                        store = get_store(collection, len(vecs[0]), storage=data.get("vectorStorage"))
+                    store.upsert(_batch_docs(collection, ev["idxs"], vecs, chunk_texts, metas))
+                    indexed += len(ev["idxs"])
+                    ev = {"type": "indexed", "collection": collection, "chunks": indexed, "partial": indexed < len(chunk_texts)}
                 yield send(ev)
                 last_emit = time.time()
             except queue.Empty:
@@ -190,24 +408,14 @@ def rag_ingest_stream():
                     last_emit = time.time()
 
         if err_holder.get("error"):
-            yield send({"type": "error", "error": err_holder["error"]})
+            yield send({"type": "error", "error": err_holder["error"], "chunks": indexed})
             return
 
-        vecs = result_holder.get("vecs") or []
-        if not vecs:
+        if not indexed:
             yield send({"type": "error", "error": "embedding failed or empty"})
             return
 
-        # Upsert into vector store
-        dim = len(vecs[0])
-        store = get_store(collection, dim)
-        docs: List[VectorDoc] = []
-        for i, (c, v, meta) in enumerate(zip(chunk_texts, vecs, metas)):
-            doc_id = f"{collection}:{meta.get('bilaga')}:{meta.get('sida')}:{i}"
-            docs.append(VectorDoc(id=doc_id, text=c, embedding=v, meta=meta))
-        store.upsert(docs)
-        yield send({"type": "indexed", "collection": collection, "chunks": len(docs)})
-        yield send({"type": "done", "collection": collection, "chunks": len(docs)})
+        yield send({"type": "done", "collection": collection, "chunks": indexed})
 
     return Response(stream_with_context(gen()), mimetype="application/x-ndjson")
 
@@ -226,10 +434,20 @@ def rag_query():
     append_sources = bool(data.get("appendSources", True))
     enforce_inline = bool(data.get("enforceInlineCitations", False))
 
+    dim = get_dim(collection)
+    if dim is None:
+        return jsonify({"reply": "Inga källor hittades för denna samling.", "sources": []})
     # Embed query and search in collection
-    qv = embed_texts([query], model=emb_model)[0]
-    store = get_store(collection, len(qv))
-    results = store.query(qv, top_k=top_k)
+    # Embed at the requested size (full size by default) and shorten to the collection's size
+    # here, so full-size cache entries stay reusable; a shorter vector cannot be matched
+    qv = embed_texts([query], model=emb_model, dimensions=_embedding_dims(data))[0]
+    if len(qv) < dim:
+        return jsonify({
+            "error": f"query embedding has {len(qv)} dimensions but collection '{collection}' has {dim}; "
+            "use the embeddingModel/embeddingDimensions the collection was ingested with"
+        }), 400
+    qv = truncate_embedding(qv, dim) if len(qv) > dim else qv
+    results = get_store(collection, dim).query(qv, top_k=top_k)
     if not results:
         return jsonify({"reply": "Inga källor hittades för denna samling.", "sources": []})
 
@@ -241,7 +459,12 @@ def rag_query():
         sida = (d.meta or {}).get("sida", "?")
         preview = (d.text or "").strip().replace("\n", " ")
         context_lines.append(f"(Bilaga {bil}, Sida {sida}) \"{preview}\"")
-        sources_out.append({"bilaga": bil, "sida": sida, "score": round(float(score), 4)})
+        src = {"bilaga": bil, "sida": sida, "score": round(float(score), 4)}
+        sidor = (d.meta or {}).get("sidor") or []
+        if len(sidor) > 1:
+            # Near-duplicate pages collapsed into this chunk at ingest
+            src["sidor"] = sidor
+        sources_out.append(src)
 
     system = (
         "Svara endast utifrån Given Context. Lägg till källhänvisningar i formatet "
@@ -261,6 +484,7 @@ def rag_query():
 
     client = get_client()
     max_comp = int(data.get("max_tokens", data.get("max_completion_tokens", 600)))
+    throttle(None, model, estimate_chat_tokens(messages, max_comp))
     resp = client.chat.completions.create(model=model, messages=messages, max_completion_tokens=max_comp)
     reply = resp.choices[0].message.content if resp.choices else ""
     # Optionally enforce inline citations if model omitted them
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from services.openai_service import get_client
 from services.tokenizer import chunk_text
+from services.rate_limit import estimate_chat_tokens, throttle
 
 
 sliding_bp = Blueprint("sliding", __name__)
@@ -29,6 +30,7 @@ def sliding_window():
             {"role": "system", "content": "Besvara frågan endast utifrån detta fönster av texten."},
             {"role": "user", "content": f"TEXT:\n{w}\n\nFRÅGA:\n{ask}"},
         ]
+    throttle(None, model, estimate_chat_tokens(msgs, 400))
     r = client.chat.completions.create(model=model, messages=msgs, max_completion_tokens=400)
     a = r.choices[0].message.content if r.choices else ""
     answers.append(a or "")
@@ -37,6 +39,7 @@ def sliding_window():
         {"role": "system", "content": "Sammanfatta konsistent vad som framgår av del-svaren utan motsägelser."},
         {"role": "user", "content": "\n\n---\n\n".join(answers)},
     ]
+    throttle(None, model, estimate_chat_tokens(msgs2, 600))
     r2 = client.chat.completions.create(model=model, messages=msgs2, max_completion_tokens=600)
     final = r2.choices[0].message.content if r2.choices else ""
     return jsonify({"answer": final, "steps": len(windows)})
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from services.openai_service import get_client
 from services.tokenizer import chunk_text
+from services.rate_limit import estimate_chat_tokens, throttle
 
 
 summarize_bp = Blueprint("summarize", __name__)
@@ -27,6 +28,7 @@ def hierarchical():
             {"role": "system", "content": layer_prompt},
             {"role": "user", "content": ch},
         ]
+    throttle(None, model, estimate_chat_tokens(msgs, 300))
     r = client.chat.completions.create(model=model, messages=msgs, max_completion_tokens=300)
     s = r.choices[0].message.content if r.choices else ""
     first_summaries.append(s or "")
@@ -37,6 +39,8 @@ def hierarchical():
         {"role": "system", "content": "Kondensera följande delsummeringar till en executive summary."},
         {"role": "user", "content": joined},
     ]
-    r2 = client.chat.completions.create(model=model, messages=msgs2, max_completion_tokens=int(data.get("max_tokens", data.get("max_completion_tokens", 800))))
+    max_final = int(data.get("max_tokens", data.get("max_completion_tokens", 800)))
+    throttle(None, model, estimate_chat_tokens(msgs2, max_final))
+    r2 = client.chat.completions.create(model=model, messages=msgs2, max_completion_tokens=max_final)
     final = r2.choices[0].message.content if r2.choices else ""
     return jsonify({"summary": final, "parts": len(chunks)})
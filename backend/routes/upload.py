@@ -1,47 +1,66 @@
 import io
+import mimetypes
 import os
 import re
-import time
-from flask import Blueprint, current_app, jsonify, request, send_from_directory
+from urllib.parse import quote
+from flask import Blueprint, current_app, jsonify, request, send_file
+from werkzeug.utils import safe_join
 
 try:
     from pypdf import PdfReader  # type: ignore
 except Exception:
     PdfReader = None  # type: ignore
 
-# Prefer our cleaner PyMuPDF-based extractor if available
+# Prefer our cleaner PyMuPDF-based extractor (behind the content-addressed cache) if available
 try:
-    from services import pdf_extractor as _pdfx  # type: ignore
+    from services.extraction_cache import cached_extract_pages, iter_cached_pages  # type: ignore
 except Exception:
-    _pdfx = None  # type: ignore
+    cached_extract_pages = iter_cached_pages = None  # type: ignore
+
+from services.upload_store import content_etag, read_text_pages, store_text, store_upload
+
+try:
+    from services.jobs import register_handler, submit_job  # type: ignore
+except Exception:
+    register_handler = submit_job = None  # type: ignore
 
 upload_bp = Blueprint("upload", __name__)
 
 
+def _as_file(src):
+    """Path or bytes -> something the PDF libraries can open."""
+    return src if isinstance(src, str) else io.BytesIO(src)
+
+
+def _plumber_pages(src, digest=None):
+    """Yield (page_no, text) via pdfplumber, one page at a time so callers can stop early.
+    `src` is a file path or raw bytes."""
+    if iter_cached_pages is not None:
+        for p in iter_cached_pages(src, engine="pdfplumber", clean=False, digest=digest):
+            yield p.page, p.text or ""
+        return
+    import pdfplumber
+    with pdfplumber.open(_as_file(src)) as pdf:
+        for idx, page in enumerate(pdf.pages, start=1):
+            yield idx, page.extract_text() or ""
+
+
 def _extract_text(filename: str, stream: bytes) -> str:
     name = (filename or "").lower()
     if name.endswith(".pdf"):
         # Try our PyMuPDF-based extractor first for higher-quality text
-        if _pdfx is not None:
+        if cached_extract_pages is not None:
             try:
-                pages = _pdfx.extract_pages(stream)
-                pages = _pdfx.strip_headers_footers(pages)
-                pages = _pdfx.dedupe_repeated_lines(pages)
+                pages = cached_extract_pages(stream)
                 if pages:
                     return "\n\n".join((p.text or "") for p in pages).strip()
             except Exception:
                 pass
         # Fallback to pdfplumber
         try:
-            import pdfplumber
-            with pdfplumber.open(io.BytesIO(stream)) as pdf:
-                parts = []
-                for page in pdf.pages:
-                    t = page.extract_text()
-                    if t:
-                        parts.append(t)
-                if parts:
-                    return "\n\n".join(parts).strip()
+            parts = [t for _, t in _plumber_pages(stream) if t]
+            if parts:
+                return "\n\n".join(parts).strip()
         except Exception:
             pass
         # Fallback to PyPDF
@@ -64,8 +83,186 @@ def _extract_text(filename: str, stream: bytes) -> str:
         return ""
 
 
+def _join_pages_with_markers(pages_list):
+    try:
+        parts = []
+        for p in (pages_list or []):
+            num = p.get("page")
+            txt = p.get("text", "")
+            parts.append(f"[Sida {num}]\n{txt}")
+        return "\n\n".join(parts)
+    except Exception:
+        try:
+            return "\n\n".join((p.get("text", "") for p in (pages_list or [])))
+        except Exception:
+            return ""
+
+
+def _extract_item(name, src, digest, max_chars):
+    """Text for one stored upload: (text, pages or None, truncated). `src` is a path or bytes."""
+    lower = (name or "").lower()
+    pages = None
+    text = ""
+    truncated = False
+    if lower.endswith(".pdf"):
+        # Prefer PyMuPDF-based extractor with cleaning; fallback to pdfplumber/pypdf
+        pages = []
+        cur_total = 0
+        used_clean_extractor = False
+        if iter_cached_pages is not None:
+            try:
+                # Cleaned pages are produced lazily (straight from the extraction cache for
+                # repeat uploads); the full document is still cached when we stop at maxChars
+                pg_objs = iter_cached_pages(src, digest=digest)
+                for obj in pg_objs:
+                    t = obj.text or ""
+                    if not t:
+                        continue
+                    if cur_total + len(t) <= max_chars:
+                        pages.append({"page": obj.page, "text": t})
+                        cur_total += len(t)
+                    else:
+                        remain = max_chars - cur_total
+                        if remain > 0:
+                            pages.append({"page": obj.page, "text": t[:remain]})
+                            cur_total += remain
+                        truncated = True
+                        break
+                # Finish and store the cache entry now rather than at garbage collection
+                pg_objs.close()
+                used_clean_extractor = True
+            except Exception:
+                pages = []
+                cur_total = 0
+                used_clean_extractor = False
+        if not used_clean_extractor:
+            try:
+                for idx, t in _plumber_pages(src, digest):
+                    if not t:
+                        continue
+                    if cur_total + len(t) <= max_chars:
+                        pages.append({"page": idx, "text": t})
+                        cur_total += len(t)
+                    else:
+                        remain = max_chars - cur_total
+                        if remain > 0:
+                            pages.append({"page": idx, "text": t[:remain]})
+                            cur_total += remain
+                        truncated = True
+                        break
+            except Exception:
+                if PdfReader is not None:
+                    try:
+                        reader = PdfReader(_as_file(src))
+                        for idx, p in enumerate(reader.pages, start=1):
+                            t = p.extract_text() or ""
+                            if not t:
+                                continue
+                            if cur_total + len(t) <= max_chars:
+                                pages.append({"page": idx, "text": t})
+                                cur_total += len(t)
+                            else:
+                                remain = max_chars - cur_total
+                                if remain > 0:
+                                    pages.append({"page": idx, "text": t[:remain]})
+                                    cur_total += remain
+                                truncated = True
+                                break
+                    except Exception:
+                        text = "[Kunde inte extrahera text från PDF]"
+                else:
+                    text = "[PDF-stöd saknas: installera pypdf]"
+        # Build text
+        if pages and not text:
+            text = _join_pages_with_markers(pages)
+    else:
+        try:
+            if isinstance(src, str):
+                with open(src, "rb") as fh:
+                    text = fh.read().decode("utf-8", errors="ignore")
+            else:
+                text = src.decode("utf-8", errors="ignore")
+        except Exception:
+            text = ""
+    return text, pages, truncated
+
+
+def _make_item(name, text, pages, truncated, url):
+    item = {"name": name, "chars": len(text), "truncated": truncated, "text": text}
+    if pages is not None:
+        item["pages"] = pages
+    if url:
+        item["url"] = url
+    return item
+
+
+def _make_compact_item(upload_dir, name, text, pages, truncated, url):
+    """Item without the text: document id plus page byte offsets; pages come from /upload/<id>/pages."""
+    doc = store_text(upload_dir, text, pages)
+    item = {
+        "name": name,
+        "id": doc["id"],
+        "chars": len(text),
+        "truncated": truncated,
+        "bytes": doc["bytes"],
+        "pageCount": len(doc["pages"]),
+        "pages": doc["pages"],
+    }
+    if url:
+        item["url"] = url
+    return item
+
+
+def _build_item(name, src, digest, max_chars, url, compact_dir=None):
+    text, pages, truncated = _extract_item(name, src, digest, max_chars)
+    if compact_dir:
+        return _make_compact_item(compact_dir, name, text, pages, truncated, url)
+    return _make_item(name, text, pages, truncated, url)
+
+
+def _upload_job(payload, emit):
+    """Background /upload: extract every stored file, same result shape as the synchronous response."""
+    files = payload.get("files") or []
+    max_chars = int(payload.get("maxChars") or 1000000)
+    emit({"type": "started", "files": len(files)})
+    items = []
+    total_chars = 0
+    for i, f in enumerate(files):
+        emit({"type": "progress", "stage": "extract", "name": f.get("name"), "done": i, "total": len(files)})
+        item = _build_item(f.get("name"), f.get("path"), f.get("sha256"), max_chars, f.get("url"), payload.get("compactDir"))
+        total_chars += item["chars"]
+        items.append(item)
+        emit({"type": "extracted", "name": f.get("name"), "chars": item["chars"], "truncated": item["truncated"]})
+    result = {"count": len(items), "totalChars": total_chars, "items": items}
+    if payload.get("compactDir"):
+        result["compact"] = True
+    emit({"type": "done", "count": len(items), "totalChars": total_chars})
+    return result
+
+
+if register_handler is not None:
+    register_handler("upload", _upload_job)
+
+
+def _files_base_url() -> str:
+    """Origin for /files links: FILES_BASE_URL when set ("/" gives relative /files/... URLs that
+    resolve against the page, e.g. the nginx frontend that proxies /files), else this host."""
+    base = os.getenv("FILES_BASE_URL")
+    if base is not None and base.strip():
+        return base.strip().rstrip("/")
+    return (request.host_url or "").rstrip("/")
+
+
+def _truthy(v) -> bool:
+    return str(v or "").strip().lower() in {"1", "true", "yes", "on"}
+
+
 @upload_bp.route("/upload", methods=["POST", "OPTIONS"])
 def upload_files():
+    """Upload + extraction. With form field async=1 the files are stored and a background job
+    extracts them; the response is 202 with jobId (poll /jobs/<id>, stream /jobs/<id>/stream).
+    With compact=1 items carry a document id and page byte offsets instead of the text;
+    fetch pages lazily from /upload/<id>/pages."""
     if request.method == "OPTIONS":
         return ("", 204)
     try:
@@ -76,8 +273,11 @@ def upload_files():
             max_chars = int(request.form.get("maxChars", "1000000"))
         except Exception:
             max_chars = 1000000
+        background = _truthy(request.form.get("async")) and submit_job is not None
+        compact = _truthy(request.form.get("compact"))
 
         items = []
+        stored_files = []
         total_chars = 0
         try:
             from werkzeug.utils import secure_filename  # type: ignore
@@ -87,135 +287,102 @@ def upload_files():
 
         base_url = (request.host_url or "").rstrip("/")
 
-        def _join_pages_with_markers(pages_list):
+        upload_dir = current_app.config.get("UPLOAD_DIR")
+        compact_dir = upload_dir if compact else None
+        for f in files:
+            name = f.filename
+            # Stream the part to content-addressed storage instead of holding it in memory;
+            # extraction then reads the stored file by path
+            stored = None
             try:
-                parts = []
-                for p in (pages_list or []):
-                    num = p.get("page")
-                    txt = p.get("text", "")
-                    parts.append(f"[Sida {num}]\n{txt}")
-                return "\n\n".join(parts)
+                stored = store_upload(f.stream, upload_dir, secure_filename(name or "file"))
+                src = stored.path
             except Exception:
+                if background:
+                    raise
+                current_app.logger.warning("upload: could not store %s on disk", name, exc_info=True)
                 try:
-                    return "\n\n".join((p.get("text", "") for p in (pages_list or [])))
+                    f.stream.seek(0)
                 except Exception:
-                    return ""
+                    pass
+                src = f.read()
+            digest = stored.sha256 if stored else None
 
-        for f in files:
-            raw = f.read()
-            name = f.filename
-            lower = (name or "").lower()
-            pages = None
-            text = ""
-            truncated = False
-            if lower.endswith(".pdf"):
-                # Prefer PyMuPDF-based extractor with cleaning; fallback to pdfplumber/pypdf
-                pages = []
-                cur_total = 0
-                used_clean_extractor = False
-                if _pdfx is not None:
-                    try:
-                        pg_objs = _pdfx.extract_pages(raw)
-                        pg_objs = _pdfx.strip_headers_footers(pg_objs)
-                        pg_objs = _pdfx.dedupe_repeated_lines(pg_objs)
-                        for obj in pg_objs:
-                            t = obj.text or ""
-                            if not t:
-                                continue
-                            if cur_total + len(t) <= max_chars:
-                                pages.append({"page": obj.page, "text": t})
-                                cur_total += len(t)
-                            else:
-                                remain = max_chars - cur_total
-                                if remain > 0:
-                                    pages.append({"page": obj.page, "text": t[:remain]})
-                                    cur_total += remain
-                                truncated = True
-                                break
-                        used_clean_extractor = True
-                    except Exception:
-                        pages = []
-                        cur_total = 0
-                        used_clean_extractor = False
-                if not used_clean_extractor:
-                    try:
-                        import pdfplumber
-                        with pdfplumber.open(io.BytesIO(raw)) as pdf:
-                            for idx, page in enumerate(pdf.pages, start=1):
-                                t = page.extract_text() or ""
-                                if not t:
-                                    continue
-                                if cur_total + len(t) <= max_chars:
-                                    pages.append({"page": idx, "text": t})
-                                    cur_total += len(t)
-                                else:
-                                    remain = max_chars - cur_total
-                                    if remain > 0:
-                                        pages.append({"page": idx, "text": t[:remain]})
-                                        cur_total += remain
-                                    truncated = True
-                                    break
-                    except Exception:
-                        if PdfReader is not None:
-                            try:
-                                reader = PdfReader(io.BytesIO(raw))
-                                for idx, p in enumerate(reader.pages, start=1):
-                                    t = p.extract_text() or ""
-                                    if not t:
-                                        continue
-                                    if cur_total + len(t) <= max_chars:
-                                        pages.append({"page": idx, "text": t})
-                                        cur_total += len(t)
-                                    else:
-                                        remain = max_chars - cur_total
-                                        if remain > 0:
-                                            pages.append({"page": idx, "text": t[:remain]})
-                                            cur_total += remain
-                                        truncated = True
-                                        break
-                            except Exception:
-                                text = "[Kunde inte extrahera text från PDF]"
-                        else:
-                            text = "[PDF-stöd saknas: installera pypdf]"
-                # Build text
-                if pages and not text:
-                    text = _join_pages_with_markers(pages)
-            else:
-                try:
-                    text = raw.decode("utf-8", errors="ignore")
-                except Exception:
-                    text = ""
+            # Served from the content-addressed store (same URL for the same file and name)
+            file_url = f"{_files_base_url()}/files/{stored.name}" if stored else None
+            if background:
+                stored_files.append({"name": name, "path": src, "sha256": digest, "url": file_url})
+                continue
 
-            # Save file for static serving
-            try:
-                ts = int(time.time() * 1000)
-                fn = secure_filename(name or "file")
-                stored_name = f"{ts}_{fn}"
-                upload_dir = current_app.config.get("UPLOAD_DIR")
-                os.makedirs(upload_dir, exist_ok=True)
-                with open(os.path.join(upload_dir, stored_name), "wb") as out:
-                    out.write(raw)
-                file_url = f"{base_url}/files/{stored_name}"
-            except Exception:
-                stored_name = None
-                file_url = None
-
-            total_chars += len(text)
-            item = {"name": name, "chars": len(text), "truncated": truncated, "text": text}
-            if pages is not None:
-                item["pages"] = pages
-            if file_url:
-                item["url"] = file_url
+            item = _build_item(name, src, digest, max_chars, file_url, compact_dir)
+            total_chars += item["chars"]
             items.append(item)
 
-        return jsonify({"count": len(items), "totalChars": total_chars, "items": items})
+        if background:
+            job_id = submit_job("upload", {"files": stored_files, "maxChars": max_chars, "compactDir": compact_dir})
+            return jsonify({
+                "jobId": job_id,
+                "status": "queued",
+                "statusUrl": f"{base_url}/jobs/{job_id}",
+                "streamUrl": f"{base_url}/jobs/{job_id}/stream",
+                "files": [{"name": f["name"], "url": f["url"]} for f in stored_files],
+            }), 202
+        out = {"count": len(items), "totalChars": total_chars, "items": items}
+        if compact:
+            out["compact"] = True
+        return jsonify(out)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
+@upload_bp.get("/upload/<doc_id>/pages")
+def upload_pages(doc_id: str):
+    """Sidor ur en kompakt uppladdning: ?from=N&to=M (sidnummer, inklusive); utan intervall alla sidor."""
+    try:
+        first = int(request.args["from"]) if request.args.get("from") else None
+        last = int(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"error": "from/to must be page numbers"}), 400
+    try:
+        return jsonify(read_text_pages(current_app.config.get("UPLOAD_DIR"), doc_id, first, last))
+    except KeyError:
+        return jsonify({"error": "unknown document"}), 404
+
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+def _accel_prefix():
+    """X-Accel-Redirect location prefix when nginx should send the bytes (FILES_ACCEL_REDIRECT,
+    e.g. /_uploads/). Only used for requests proxied with "X-Sendfile-Type: X-Accel-Redirect",
+    so direct hits on the backend still get the file."""
+    prefix = (os.getenv("FILES_ACCEL_REDIRECT") or "").strip()
+    if prefix and request.headers.get("X-Sendfile-Type", "").lower() == "x-accel-redirect":
+        return prefix.rstrip("/") + "/"
+    return None
+
+
 @upload_bp.get("/files/<path:fname>")
 def serve_file(fname: str):
-    try:
-        return send_from_directory(current_app.config.get("UPLOAD_DIR"), fname, as_attachment=False)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 404
+    """Uppladdade filer med villkorlig GET (ETag/Last-Modified), byte ranges (PDF.js) och
+    immutable-cache för innehållsadresserade namn. Kan lämna över till nginx via X-Accel-Redirect."""
+    path = safe_join(current_app.config.get("UPLOAD_DIR"), fname)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "file not found"}), 404
+    etag = content_etag(fname)
+    prefix = _accel_prefix()
+    if prefix:
+        resp = current_app.response_class(status=200)
+        if etag:
+            resp.set_etag(etag)
+            if request.if_none_match.contains(etag):
+                resp.status_code = 304
+        if resp.status_code == 200:
+            # nginx serves the bytes (Range, sendfile) from its internal location
+            resp.headers["X-Accel-Redirect"] = prefix + quote(fname)
+            resp.headers["Content-Type"] = mimetypes.guess_type(fname)[0] or "application/octet-stream"
+    else:
+        # conditional=True: 304 on If-None-Match/If-Modified-Since, 206 for Range requests
+        resp = send_file(path, conditional=True, etag=etag or True)
+    resp.headers["Cache-Control"] = IMMUTABLE_CACHE if etag else "no-cache"
+    return resp
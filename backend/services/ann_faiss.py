@@ -17,6 +17,9 @@ class AnnItem:
 
 
 class FaissIndex:
+    """FAISS index over L2-normalized vectors. `dim` may be a reduced (Matryoshka) size;
+    longer vectors are truncated to `dim` before normalization."""
+
     def __init__(self, dim: int, kind: str = "flat_ip"):
         if faiss is None:
             raise RuntimeError("faiss is not installed. pip install faiss-cpu")
@@ -49,7 +52,7 @@ class FaissIndex:
         if not items:
             return
         mat = np.array([x.vector for x in items], dtype="float32")
-        mat = self._l2_normalize(mat)
+        mat = self._l2_normalize(mat[:, : self.dim])
         self.index.add(mat)
         self._ids.extend([x.id for x in items])
         self._meta.extend([x.meta for x in items])
@@ -58,7 +61,7 @@ class FaissIndex:
         import numpy as np
 
         q = np.array([vector], dtype="float32")
-        q = self._l2_normalize(q)
+        q = self._l2_normalize(q[:, : self.dim])
         D, I = self.index.search(q, top_k)
         out: List[Tuple[str, float, Optional[dict]]] = []
         for i, d in zip(I[0], D[0]):
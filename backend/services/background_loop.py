@@ -0,0 +1,85 @@
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Optional
+import asyncio
+import os
+import threading
+
+
+class BackgroundLoop:
+    """A long-lived asyncio event loop on a daemon thread.
+
+    Synchronous code (Flask handlers) submits coroutines with `submit()` and gets a
+    concurrent.futures.Future back, so there is no per-call loop/thread-pool setup and
+    anything bound to the loop (clients, limiters, connection pools) can be reused.
+    """
+
+    def __init__(self, name: str = "background-loop", max_workers: Optional[int] = None):
+        self.name = name
+        self._ready = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Pool behind asyncio.to_thread; sized for the blocking SDK calls we offload
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-io")
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_default_executor(self._executor)
+        self._loop = loop
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        assert self._loop is not None
+        return self._loop
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro: Awaitable[Any]) -> "Future[Any]":
+        """Schedule a coroutine on the loop; returns a thread-safe Future."""
+        if self.in_loop_thread():
+            # Blocking on .result() from here would deadlock the loop
+            raise RuntimeError("BackgroundLoop.submit() called from its own loop thread; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)  # type: ignore[arg-type]
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Submit and block for the result."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False)
+
+
+_loops: dict = {}
+_loops_lock = threading.Lock()
+
+
+def get_background_loop(name: str = "embeddings") -> BackgroundLoop:
+    """Process-wide loop per name (recreated after fork; threads do not survive fork).
+
+    The offload pool size comes from BACKGROUND_LOOP_THREADS (default 32).
+    """
+    key = (name, os.getpid())
+    bg = _loops.get(key)
+    if bg is not None:
+        return bg
+    with _loops_lock:
+        bg = _loops.get(key)
+        if bg is None:
+            try:
+                workers = int(os.getenv("BACKGROUND_LOOP_THREADS", "32"))
+            except Exception:
+                workers = 32
+            bg = BackgroundLoop(name=name, max_workers=max(1, workers))
+            _loops[key] = bg
+    return bg
@@ -0,0 +1,57 @@
+from __future__ import annotations
+from typing import Iterable, Optional
+import gzip
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover
+    brotli = None  # type: ignore
+
+
+# Text-like bodies worth compressing; PDFs/images are already compressed
+COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/")
+
+
+def available_encodings() -> list:
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def choose_encoding(accept_encodings) -> Optional[str]:
+    """Best supported coding for a werkzeug Accept-Encoding header (brotli preferred on ties)."""
+    try:
+        return accept_encodings.best_match(available_encodings())
+    except Exception:
+        return None
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    # Moderate levels: a large JSON payload compresses well at a fraction of the max-level CPU
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_response(resp, accept_encodings, min_bytes: int = 1024, mimetypes: Iterable[str] = COMPRESSIBLE):
+    """Compress a buffered Flask response in place when the client accepts gzip/br.
+
+    Streaming/passthrough responses (NDJSON streams, send_file) and responses that are small,
+    already encoded or not text-like are left alone.
+    """
+    if resp.is_streamed or resp.direct_passthrough or resp.status_code < 200 or resp.status_code in (204, 304):
+        return resp
+    if "Content-Encoding" in resp.headers or "Content-Range" in resp.headers:
+        return resp
+    if not (resp.mimetype or "").startswith(tuple(mimetypes)):
+        return resp
+    data = resp.get_data()
+    if len(data) < min_bytes:
+        return resp
+    encoding = choose_encoding(accept_encodings)
+    vary = resp.headers.get("Vary")
+    if "accept-encoding" not in (vary or "").lower():
+        resp.headers["Vary"] = (vary + ", Accept-Encoding") if vary else "Accept-Encoding"
+    if not encoding:
+        return resp
+    resp.set_data(compress_bytes(data, encoding))
+    resp.headers["Content-Encoding"] = encoding
+    return resp
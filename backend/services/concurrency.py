@@ -0,0 +1,186 @@
+from __future__ import annotations
+from typing import Dict, Optional, Tuple
+import asyncio
+import re
+import threading
+import time
+import weakref
+
+
+# Error classification for OpenAI SDK exceptions (duck-typed so the SDK stays optional)
+
+_TRANSIENT_MARKERS = [
+    "429", "rate", "temporarily", "timeout", "5xx", "internal", "overloaded", "connection", "reset", "unavailable"
+]
+_DURATION_RX = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+
+def _parse_duration(val: str) -> Optional[float]:
+    """Parse '1.5', '20ms', '6m0s' style header values into seconds."""
+    val = (val or "").strip()
+    if not val:
+        return None
+    try:
+        return max(0.0, float(val))
+    except ValueError:
+        pass
+    total = 0.0
+    found = False
+    for num, unit in _DURATION_RX.findall(val):
+        found = True
+        total += float(num) * {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}[unit]
+    return total if found else None
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Server-requested wait from Retry-After / retry-after-ms / x-ratelimit-reset-* headers
+    (or the `retry_after` of a local RateLimitExceeded)."""
+    local = getattr(exc, "retry_after", None)
+    if isinstance(local, (int, float)):
+        return max(0.0, float(local))
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return max(0.0, float(ms) / 1000.0)
+    except Exception:
+        pass
+    waits = []
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        try:
+            v = _parse_duration(headers.get(name) or "")
+        except Exception:
+            v = None
+        if v is not None:
+            waits.append(v)
+    return max(waits) if waits else None
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, bool, Optional[float]]:
+    """Return (transient, overload, retry_after_sec) for an API exception.
+
+    overload means the server asked us to slow down (429/503/529 or a RateLimitError);
+    transient covers those plus timeouts, connection errors and other 5xx.
+    """
+    name = type(exc).__name__
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    retry_after = retry_after_seconds(exc)
+    if name == "RateLimitError" or status in (429, 503, 529):
+        return True, True, retry_after
+    if name in ("APITimeoutError", "APIConnectionError", "InternalServerError") or (
+        isinstance(status, int) and status >= 500
+    ):
+        return True, False, retry_after
+    if isinstance(status, int) and 400 <= status < 500:
+        return False, False, None
+    msg = str(exc).lower()
+    transient = any(code in msg for code in _TRANSIENT_MARKERS)
+    overload = transient and any(code in msg for code in ("429", "rate", "overloaded"))
+    return transient, overload, retry_after
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease concurrency window for async workers.
+
+    The window grows by ~1 slot per window's worth of successful calls while latency stays
+    close to the observed baseline, and halves (at most once per round trip) on overload.
+    A server-provided Retry-After pauses new acquisitions until it has elapsed.
+    """
+
+    def __init__(self, initial: int = 6, minimum: int = 1, maximum: int = 32, latency_slack: float = 1.5):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.window = float(min(self.maximum, max(self.minimum, int(initial))))
+        self.latency_slack = float(latency_slack)
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._pause_until = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    @property
+    def limit(self) -> int:
+        return max(self.minimum, int(self.window))
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        while True:
+            wait = self._pause_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            async with cond:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                await cond.wait()
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            cond.notify_all()
+
+    def on_success(self, latency: float):
+        """Record a successful call's latency (seconds, normalized by the caller if needed)."""
+        if self.baseline is None:
+            self.baseline = latency
+        elif latency < self.baseline:
+            # Track the best case quickly, drift back up slowly
+            self.baseline = latency
+        else:
+            self.baseline = 0.95 * self.baseline + 0.05 * latency
+        if latency <= self.baseline * self.latency_slack:
+            self.window = min(float(self.maximum), self.window + 1.0 / self.window)
+
+    def on_overload(self, retry_after: Optional[float] = None) -> bool:
+        """Halve the window; returns True if this call actually decreased it."""
+        now = time.monotonic()
+        if retry_after:
+            self._pause_until = max(self._pause_until, now + retry_after)
+        # Failures from batches that were already in flight belong to the same congestion event
+        if now - self._last_decrease < max(1.0, self.baseline or 0.0):
+            return False
+        self._last_decrease = now
+        self.window = max(float(self.minimum), self.window / 2.0)
+        self.decreases += 1
+        return True
+
+
+# Event loop -> {key: limiter}. Limiters hold their loop once used, so weak keys alone don't
+# release it; entries of closed loops (per-call asyncio.run fallbacks) are pruned on access
+_shared_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AIMDLimiter]]" = weakref.WeakKeyDictionary()
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_limiter(key: str, initial: int = 6, maximum: int = 32) -> AIMDLimiter:
+    """AIMD window shared by every call on the running loop for `key` (e.g. model + API key).
+
+    The window learned from overloads carries over to later calls, and concurrent calls
+    draw from one window instead of each starting at `initial`. Must be called from inside
+    the loop (the limiter's Condition is bound to it).
+    """
+    loop = asyncio.get_running_loop()
+    with _shared_limiters_lock:
+        for closed in [lp for lp in _shared_limiters.keys() if lp.is_closed()]:
+            del _shared_limiters[closed]
+        per_loop = _shared_limiters.get(loop)
+        if per_loop is None:
+            per_loop = _shared_limiters[loop] = {}
+        limiter = per_loop.get(key)
+        if limiter is None:
+            limiter = per_loop[key] = AIMDLimiter(initial=initial, maximum=maximum)
+        elif maximum > limiter.maximum:
+            limiter.maximum = int(maximum)
+    return limiter
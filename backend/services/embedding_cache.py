@@ -1,42 +1,528 @@
 from __future__ import annotations
-from typing import Iterable, List, Sequence, Tuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from array import array
+from collections import OrderedDict
 import sqlite3
 import os
+import struct
+import sys
+import logging
 import threading
+import time
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+
+# Row encodings stored in the `ver` column
+VER_TEXT = 1  # legacy: space-separated decimal floats (utf-8)
+VER_F32 = 2  # packed little-endian float32
+VER_F16 = 3  # packed little-endian float16
+VER_I8 = 4  # float32 per-vector scale followed by symmetric int8 codes (x ~= code * scale)
+
+# Bumped when the table layout changes; tracked via PRAGMA user_version
+# 2: `ver` column (binary encodings), 3: `last_access` column + incremental auto_vacuum
+SCHEMA_VERSION = 3
+
+_DTYPES = {"float32": VER_F32, "f32": VER_F32, "float16": VER_F16, "f16": VER_F16, "int8": VER_I8, "i8": VER_I8}
+
+Vector = Union["np.ndarray", array, List[float]]
+
+
+def encode_vector(vec: Sequence[float], ver: int = VER_F32) -> bytes:
+    """Pack a vector into a little-endian float32/float16/int8 BLOB."""
+    if ver == VER_I8:
+        return _encode_int8(vec)
+    if np is not None:
+        return np.asarray(vec, dtype="<f2" if ver == VER_F16 else "<f4").tobytes()
+    if ver == VER_F16:
+        return struct.pack("<%de" % len(vec), *vec)
+    a = array("f", vec)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def decode_vector(blob: bytes, ver: int) -> Vector:
+    """Decode a BLOB without going through per-component string parsing.
+
+    Returns a float32 NumPy array (zero-copy for float32 rows) when NumPy is available,
+    otherwise an array('f'). Legacy text rows are parsed the old way.
+    """
+    if ver == VER_TEXT:
+        vals = [float(x) for x in bytes(blob).decode("utf-8").split(" ") if x]
+        return np.asarray(vals, dtype="float32") if np is not None else array("f", vals)
+    if ver == VER_I8:
+        return _decode_int8(blob)
+    if np is not None:
+        if ver == VER_F16:
+            return np.frombuffer(blob, dtype="<f2").astype("float32")
+        return np.frombuffer(blob, dtype="<f4")
+    if ver == VER_F16:
+        mv = memoryview(blob)
+        return array("f", struct.unpack("<%de" % (len(mv) // 2), mv))
+    a = array("f")
+    a.frombytes(blob)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def _encode_int8(vec: Sequence[float]) -> bytes:
+    if np is not None:
+        v = np.asarray(vec, dtype="float32")
+        peak = float(np.abs(v).max()) if v.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        codes = np.clip(np.rint(v / scale), -127, 127).astype("i1")
+        return struct.pack("<f", scale) + codes.tobytes()
+    peak = max((abs(x) for x in vec), default=0.0)
+    scale = peak / 127.0 if peak > 0 else 1.0
+    codes = [max(-127, min(127, int(round(x / scale)))) for x in vec]
+    return struct.pack("<f%db" % len(codes), scale, *codes)
+
+
+def _decode_int8(blob: bytes) -> Vector:
+    mv = memoryview(blob)
+    (scale,) = struct.unpack_from("<f", mv)
+    if np is not None:
+        return np.frombuffer(mv[4:], dtype="i1").astype("float32") * np.float32(scale)
+    return array("f", (c * scale for c in struct.unpack("<%db" % (len(mv) - 4), mv[4:])))
+
+
+def _as_f32(vec) -> Vector:
+    if np is not None:
+        return np.asarray(vec, dtype="float32")
+    return vec if isinstance(vec, array) and vec.typecode == "f" else array("f", vec)
+
+
+def _nbytes(key: str, vec) -> int:
+    n = getattr(vec, "nbytes", None)
+    if n is None:
+        n = len(vec) * getattr(vec, "itemsize", 8)
+    # Rough per-entry overhead for the key string, the array header and the dict slot
+    return int(n) + len(key) + 160
+
+
+class MemoryLRU:
+    """Thread-safe in-process LRU of float32 vectors, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max(0, int(max_bytes))
+        self._data: "OrderedDict[str, Tuple[Vector, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: Sequence[str]) -> Tuple[List[Tuple[str, Vector]], List[str]]:
+        """Return ([(key, vec)] found, [missing keys])."""
+        found: List[Tuple[str, Vector]] = []
+        missing: List[str] = []
+        with self._lock:
+            for k in keys:
+                hit = self._data.get(k)
+                if hit is None:
+                    missing.append(k)
+                    continue
+                self._data.move_to_end(k)
+                found.append((k, hit[0]))
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, items: Iterable[Tuple[str, Vector]]):
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            for k, vec in items:
+                size = _nbytes(k, vec)
+                if size > self.max_bytes:
+                    continue
+                old = self._data.pop(k, None)
+                if old is not None:
+                    self.bytes -= old[1]
+                self._data[k] = (vec, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes and self._data:
+                _, (_, size) = self._data.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except Exception:
+        return default
 
 
 class EmbeddingCache:
-    def __init__(self, path: str = ".embeddings_cache.sqlite3"):
+    """SQLite-backed vector cache.
+
+    Each thread keeps its own persistent connection, so WAL readers never block each
+    other; writers are serialized in-process to avoid SQLITE_BUSY churn.
+
+    Rows carry a `last_access` timestamp. Reads only record touched keys in memory; they are
+    written back in batches by `maintain()`, which also drops rows older than `ttl_sec`,
+    evicts least-recently-used rows above `max_bytes` and returns free pages to the OS via
+    incremental vacuum. `start_maintenance()` runs it periodically on a daemon thread.
+    """
+
+    # Keys per `IN (...)` sub-query; stays well below SQLITE_MAX_VARIABLE_NUMBER (999 on old builds)
+    MAX_VARS = 500
+    # Pending touches that trigger an inline flush when no maintenance thread is running
+    TOUCH_FLUSH_AT = 4096
+    # How long a starting worker waits for another process's schema migration
+    MIGRATE_TIMEOUT_MS = 600000
+
+    def __init__(
+        self,
+        path: str = ".embeddings_cache.sqlite3",
+        dtype: str | None = None,
+        busy_timeout_ms: int = 5000,
+        memory: Optional[MemoryLRU] = None,
+        max_bytes: Optional[int] = None,
+        ttl_sec: Optional[float] = None,
+    ):
         self.path = path
-        self._lock = threading.Lock()
+        # Optional in-process tier consulted before SQLite
+        self.memory = memory
+        self.disk_hits = 0
+        self.disk_misses = 0
+        dtype = (dtype or os.getenv("EMBEDDING_CACHE_DTYPE") or "float32").strip().lower()
+        if dtype not in _DTYPES:
+            raise ValueError(f"Unsupported cache dtype: {dtype}")
+        self.ver = _DTYPES[dtype]
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        # None/0 disables the respective limit
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.ttl_sec = float(ttl_sec) if ttl_sec else None
+        self.evicted = 0
+        self.expired = 0
+        self.vacuumed_pages = 0
+        self.last_maintenance: Optional[float] = None
+        self._touched: set = set()
+        self._touch_lock = threading.Lock()
+        self._maint_thread: Optional[threading.Thread] = None
+        self._maint_stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
         self._ensure()
 
+    def _conn(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened after fork (gunicorn workers)."""
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._write_lock = threading.Lock()
+            self._touch_lock = threading.Lock()
+            self._maint_thread = None
+            self._pid = os.getpid()
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")
+            db.execute("PRAGMA busy_timeout=%d;" % self.busy_timeout_ms)
+            self._local.db = db
+        return db
+
+    def close(self):
+        """Close the calling thread's connection (others close when their thread exits)."""
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            self._local.db = None
+            db.close()
+
     def _ensure(self):
         os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
-        with sqlite3.connect(self.path) as db:
-            db.execute(
-                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+        db = self._conn()
+        # Only takes effect on a brand-new file; existing files are switched after _migrate
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        if db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._write_lock:
+            # IMMEDIATE takes the database write lock, so worker processes starting together
+            # set up / migrate one at a time; the others re-check user_version and skip.
+            # They wait out a long migration (and its VACUUM) instead of the usual busy timeout.
+            db.execute("PRAGMA busy_timeout=%d;" % max(self.busy_timeout_ms, self.MIGRATE_TIMEOUT_MS))
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    db.execute(
+                        "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, "
+                        "vec BLOB NOT NULL, ver INTEGER NOT NULL DEFAULT %d, last_access INTEGER NOT NULL DEFAULT 0)"
+                        % VER_F32
+                    )
+                    cols = {r[1] for r in db.execute("PRAGMA table_info(cache)").fetchall()}
+                    if "ver" not in cols:
+                        # Pre-versioned cache: every existing row is text-encoded
+                        db.execute("ALTER TABLE cache ADD COLUMN ver INTEGER NOT NULL DEFAULT %d" % VER_TEXT)
+                    if "last_access" not in cols:
+                        db.execute("ALTER TABLE cache ADD COLUMN last_access INTEGER NOT NULL DEFAULT 0")
+                    db.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+                    vacuum = False
+                    if db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                        vacuum = self._migrate(db)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                if vacuum:
+                    # VACUUM cannot run inside a transaction; only the migrating process gets here
+                    db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+                    db.execute("VACUUM")
+            finally:
+                db.execute("PRAGMA busy_timeout=%d;" % self.busy_timeout_ms)
+
+    def _migrate(self, db: sqlite3.Connection, batch: int = 1000) -> bool:
+        """One-time upgrade inside _ensure's transaction: re-encode legacy text rows into packed
+        BLOBs and stamp `last_access` on pre-existing rows. Returns True when the file should be
+        VACUUMed afterwards (to reclaim the freed space / enable incremental auto_vacuum)."""
+        migrated = 0
+        while True:
+            rows = db.execute(
+                "SELECT key, vec FROM cache WHERE ver = ? LIMIT ?", (VER_TEXT, batch)
+            ).fetchall()
+            if not rows:
+                break
+            db.executemany(
+                "UPDATE cache SET vec = ?, ver = ? WHERE key = ?",
+                [(encode_vector(decode_vector(blob, VER_TEXT), self.ver), self.ver, k) for k, blob in rows],
             )
-            db.execute("PRAGMA journal_mode=WAL;")
+            migrated += len(rows)
+        db.execute("UPDATE cache SET last_access = ? WHERE last_access = 0", (int(time.time()),))
+        db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        needs_vacuum = db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+        return bool(migrated or needs_vacuum)
+
+    def _touch(self, keys: Iterable[str]):
+        with self._touch_lock:
+            self._touched.update(keys)
+            pending = len(self._touched)
+        if pending >= self.TOUCH_FLUSH_AT and self._maint_thread is None:
+            self.flush_access()
+
+    def flush_access(self) -> int:
+        """Write pending `last_access` updates in one batched transaction."""
+        with self._touch_lock:
+            keys, self._touched = list(self._touched), set()
+        if not keys:
+            return 0
+        now = int(time.time())
+        db = self._conn()
+        n = self.MAX_VARS
+        with self._write_lock, db:
+            for j in range(0, len(keys), n):
+                part = keys[j:j + n]
+                db.execute(
+                    "UPDATE cache SET last_access = ? WHERE key IN (%s)" % ",".join("?" * len(part)),
+                    [now] + part,
+                )
+        return len(keys)
+
+    def _page_stats(self, db: sqlite3.Connection) -> Tuple[int, int, int]:
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        page_count = db.execute("PRAGMA page_count").fetchone()[0]
+        freelist = db.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_size, page_count, freelist
+
+    def live_bytes(self) -> int:
+        """Bytes in use by the database (excluding free pages); cheap, no table scan."""
+        page_size, page_count, freelist = self._page_stats(self._conn())
+        return (page_count - freelist) * page_size
+
+    def evict(self, batch: int = 256) -> int:
+        """Drop expired rows (TTL) and least-recently-used rows until under `max_bytes`."""
+        db = self._conn()
+        removed = 0
+        if self.ttl_sec:
+            cutoff = int(time.time() - self.ttl_sec)
+            with self._write_lock, db:
+                cur = db.execute("DELETE FROM cache WHERE last_access < ?", (cutoff,))
+            self.expired += max(0, cur.rowcount)
+            removed += max(0, cur.rowcount)
+        if self.max_bytes and self.live_bytes() > self.max_bytes:
+            # Evict down to 90% of the cap so we don't trim on every pass
+            target = int(self.max_bytes * 0.9)
+            while self.live_bytes() > target:
+                with self._write_lock, db:
+                    cur = db.execute(
+                        "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+                        (batch,),
+                    )
+                if cur.rowcount <= 0:
+                    break
+                self.evicted += cur.rowcount
+                removed += cur.rowcount
+        return removed
 
-    def get_many(self, keys: Sequence[str]) -> List[Tuple[str, List[float]]]:
+    def compact(self, max_pages: int = 2048) -> int:
+        """Release up to `max_pages` free pages back to the filesystem (incremental vacuum)."""
+        db = self._conn()
+        before = self._page_stats(db)[2]
+        if not before:
+            return 0
+        with self._write_lock:
+            # executescript steps the pragma to completion; execute() would free only one page
+            db.executescript("PRAGMA incremental_vacuum(%d);" % max(1, int(max_pages)))
+        freed = before - self._page_stats(db)[2]
+        self.vacuumed_pages += max(0, freed)
+        return freed
+
+    def maintain(self) -> Dict[str, int]:
+        """Flush access times, evict and compact. Safe to call from any thread."""
+        touched = self.flush_access()
+        removed = self.evict()
+        freed = self.compact()
+        self.last_maintenance = time.time()
+        return {"touched": touched, "removed": removed, "freed_pages": freed}
+
+    def start_maintenance(self, interval_sec: float = 60.0):
+        """Run `maintain()` every `interval_sec` on a daemon thread (idempotent per process)."""
+        self._conn()  # resets per-process state after fork
+        if self._maint_thread is not None and self._maint_thread.is_alive():
+            return
+        self._maint_stop.clear()
+
+        def _loop():
+            while not self._maint_stop.wait(interval_sec):
+                try:
+                    self.maintain()
+                except Exception:
+                    logging.getLogger(__name__).exception("embedding cache maintenance failed")
+            self.close()
+
+        self._maint_thread = threading.Thread(target=_loop, name="embedding-cache-maint", daemon=True)
+        self._maint_thread.start()
+
+    def stop_maintenance(self):
+        self._maint_stop.set()
+        self._maint_thread = None
+
+    def get_many(self, keys: Sequence[str]) -> List[Tuple[str, Vector]]:
+        """Return (key, vector) for cached keys. Vectors are float32 NumPy arrays (or array('f')).
+
+        The in-memory tier (if any) is consulted first; only its misses hit SQLite, in bounded
+        `IN (...)` sub-queries so large key sets stay under SQLite's host-parameter limit.
+        """
         if not keys:
             return []
-        q = "SELECT key, dim, vec FROM cache WHERE key IN (%s)" % ",".join("?" * len(keys))
-        with self._lock, sqlite3.connect(self.path) as db:
-            rows = db.execute(q, list(keys)).fetchall()
-        out: List[Tuple[str, List[float]]] = []
-        for k, dim, blob in rows:
-            # Store vectors as space-separated floats in blob for simplicity
-            vec = [float(x) for x in blob.decode("utf-8").split(" ") if x]
-            out.append((k, vec))
+        uniq = list(dict.fromkeys(keys))
+        out: List[Tuple[str, Vector]] = []
+        if self.memory is not None:
+            out, uniq = self.memory.get_many(uniq)
+            if out:
+                self._touch(k for k, _ in out)
+            if not uniq:
+                return out
+        db = self._conn()
+        loaded: List[Tuple[str, Vector]] = []
+        n = self.MAX_VARS
+        for j in range(0, len(uniq), n):
+            part = uniq[j:j + n]
+            q = "SELECT key, vec, ver FROM cache WHERE key IN (%s)" % ",".join("?" * len(part))
+            for k, blob, ver in db.execute(q, part):
+                loaded.append((k, decode_vector(blob, ver)))
+        self.disk_hits += len(loaded)
+        self.disk_misses += len(uniq) - len(loaded)
+        if loaded:
+            self._touch(k for k, _ in loaded)
+        if self.memory is not None and loaded:
+            self.memory.put_many(loaded)
+        out.extend(loaded)
         return out
 
-    def put_many(self, items: Sequence[Tuple[str, List[float]]], dim: int):
+    def put_many(self, items: Sequence[Tuple[str, Sequence[float]]], dim: int):
         if not items:
             return
-        with self._lock, sqlite3.connect(self.path) as db:
+        ver = self.ver
+        # Encode outside the write lock; only the INSERT is serialized
+        now = int(time.time())
+        rows = [(k, dim, encode_vector(vec, ver), ver, now) for (k, vec) in items]
+        db = self._conn()
+        with self._write_lock, db:
             db.executemany(
-                "INSERT OR REPLACE INTO cache (key, dim, vec) VALUES (?, ?, ?)",
-                [(k, dim, (" ".join(str(x) for x in vec)).encode("utf-8")) for (k, vec) in items],
+                "INSERT OR REPLACE INTO cache (key, dim, vec, ver, last_access) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        if self.memory is not None:
+            self.memory.put_many((k, _as_f32(vec)) for (k, vec) in items)
+
+    def stats(self) -> Dict[str, object]:
+        db = self._conn()
+        page_size, page_count, freelist = self._page_stats(db)
+        out: Dict[str, object] = {
+            "path": self.path,
+            "rows": db.execute("SELECT COUNT(*) FROM cache").fetchone()[0],
+            "bytes": (page_count - freelist) * page_size,
+            "file_bytes": page_count * page_size,
+            "free_bytes": freelist * page_size,
+            "max_bytes": self.max_bytes,
+            "ttl_sec": self.ttl_sec,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "vacuumed_pages": self.vacuumed_pages,
+            "pending_touches": len(self._touched),
+            "last_maintenance": self.last_maintenance,
+            "maintenance_running": bool(self._maint_thread is not None and self._maint_thread.is_alive()),
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+        }
+        if self.memory is not None:
+            out["memory"] = self.memory.stats()
+        return out
+
+
+_shared: Optional[EmbeddingCache] = None
+_shared_pid: Optional[int] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache() -> EmbeddingCache:
+    """Process-wide cache (SQLite + in-memory LRU) shared by every caller in a worker.
+
+    Configure with EMBEDDING_CACHE_PATH, EMBEDDING_LRU_MB (0 disables the memory tier),
+    EMBEDDING_CACHE_MAX_MB / EMBEDDING_CACHE_TTL_DAYS (0 = unbounded) and
+    EMBEDDING_CACHE_MAINT_SEC (background maintenance interval, 0 disables).
+    """
+    global _shared, _shared_pid
+    pid = os.getpid()
+    if _shared is not None and _shared_pid == pid:
+        return _shared
+    with _shared_lock:
+        if _shared is None or _shared_pid != pid:
+            lru_mb = _env_float("EMBEDDING_LRU_MB", 64.0)
+            max_mb = _env_float("EMBEDDING_CACHE_MAX_MB", 0.0)
+            ttl_days = _env_float("EMBEDDING_CACHE_TTL_DAYS", 0.0)
+            maint_sec = _env_float("EMBEDDING_CACHE_MAINT_SEC", 60.0)
+            memory = MemoryLRU(int(lru_mb * 1024 * 1024)) if lru_mb > 0 else None
+            cache = EmbeddingCache(
+                os.getenv("EMBEDDING_CACHE_PATH") or ".embeddings_cache.sqlite3",
+                memory=memory,
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb > 0 else None,
+                ttl_sec=ttl_days * 86400 if ttl_days > 0 else None,
             )
+            if maint_sec > 0:
+                cache.start_maintenance(maint_sec)
+            _shared = cache
+            _shared_pid = pid
+    return _shared
@@ -1,32 +1,135 @@
 from __future__ import annotations
-from typing import List, Sequence, Tuple, Callable, Optional, Dict, Any
+from typing import AsyncIterator, Iterator, List, Sequence, Tuple, Callable, Optional, Dict, Any
 import asyncio
+import bisect
+from concurrent.futures import Future
+import queue
 import random
+import threading
 import time
+import weakref
 import logging
-from .openai_service import get_client
-from .embedding_cache import EmbeddingCache
-from .tokenizer import count_tokens
+import math
+import os
+from .openai_service import get_shared_async_client, get_shared_client
+from .background_loop import get_background_loop
+from .embedding_cache import EmbeddingCache, get_shared_cache
+from .tokenizer import count_tokens_many
+from .concurrency import classify_error, shared_limiter
+from .rate_limit import RateLimiter, estimate_texts_tokens, throttle_async
 
 
 DEFAULT_MODEL = "text-embedding-3-large"
 
 
-def _embed_sync(texts: Sequence[str], model: str) -> List[List[float]]:
+def _embed_sync(texts: Sequence[str], model: str, dimensions: Optional[int] = None) -> List[List[float]]:
     """Blocking call to the OpenAI Embeddings API.
     Separated to allow running in a thread and keep event loop responsive.
     """
-    client = get_client()
-    resp = client.embeddings.create(model=model, input=list(texts))
+    client = get_shared_client()
+    resp = client.embeddings.create(model=model, input=list(texts), **_dims_kwargs(dimensions))
     return [d.embedding for d in resp.data]
 
 
-async def _embed_async(texts: Sequence[str], model: str) -> List[List[float]]:
-    # Run the blocking SDK call in a worker thread to avoid blocking the event loop
-    return await asyncio.to_thread(_embed_sync, texts, model)
+def _dims_kwargs(dimensions: Optional[int]) -> Dict[str, Any]:
+    # Only send `dimensions` when set: older models (ada-002) reject the parameter
+    return {"dimensions": int(dimensions)} if dimensions else {}
 
 
-async def embed_batched_async(
+def truncate_embedding(vec: Sequence[float], dimensions: int) -> List[float]:
+    """Matryoshka shortening: keep the first `dimensions` components and re-normalize to unit
+    length (equivalent to requesting `dimensions` from text-embedding-3-* models)."""
+    head = list(vec[:dimensions])
+    norm = math.sqrt(sum(x * x for x in head))
+    return [x / norm for x in head] if norm > 0 else head
+
+
+async def _embed_async(
+    texts: Sequence[str], model: str, dimensions: Optional[int] = None, tokens: Optional[int] = None
+) -> List[List[float]]:
+    # Queue on the shared (cross-worker) rate limiter before spending a request. `tokens` is
+    # the batch total when the caller already counted it (token-budgeted packing); otherwise
+    # tokenize here, off the event loop since it is CPU work
+    if not tokens:
+        tokens = await asyncio.to_thread(estimate_texts_tokens, texts)
+    await throttle_async(None, model, tokens)
+    # Native async client: one pooled keep-alive connection set per API key, no thread per batch
+    client = get_shared_async_client()
+    if client is not None:
+        resp = await client.embeddings.create(model=model, input=list(texts), **_dims_kwargs(dimensions))
+        return [d.embedding for d in resp.data]
+    # Fallback: run the blocking SDK call in a worker thread to avoid blocking the event loop
+    return await asyncio.to_thread(_embed_sync, texts, model, dimensions)
+
+
+def pack_token_batches(
+    items: Sequence[Tuple[int, str, int]],
+    max_tokens: int,
+    max_items: int,
+) -> List[List[Tuple[int, str]]]:
+    """Best-fit decreasing bin packing of (idx, text, tokens) into token-budgeted batches.
+
+    Open batches are kept in a list sorted by remaining capacity, so the tightest batch that
+    still fits is found with a binary search (O(n log b) instead of scanning every batch).
+    The item cap is enforced while packing: a batch that reaches `max_items` is closed.
+    Items larger than `max_tokens` get a batch of their own.
+    """
+    max_items = max(1, int(max_items or 1))
+    batches: List[List[Tuple[int, str]]] = []
+    open_bins: List[Tuple[int, int]] = []  # (remaining tokens, batch id), sorted
+    for i, t, tok in sorted(items, key=lambda x: x[2], reverse=True):
+        pos = bisect.bisect_left(open_bins, (tok, -1))
+        if pos < len(open_bins):
+            rem, bid = open_bins.pop(pos)
+            batches[bid].append((i, t))
+            rem -= tok
+        else:
+            bid = len(batches)
+            batches.append([(i, t)])
+            rem = max_tokens - tok
+        if rem > 0 and len(batches[bid]) < max_items:
+            bisect.insort(open_bins, (rem, bid))
+    return batches
+
+
+# Single-flight registry: embedding key -> Future of its vector, per event loop. Concurrent
+# callers on the same loop (every request in a worker shares the background loop) await the
+# owner's result instead of sending the same text to the API again. Keyed by the loop object
+# (weakly) and dropped once empty, so per-call loops neither leak nor alias a dead loop's id.
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future[List[float]]]]" = weakref.WeakKeyDictionary()
+_inflight_lock = threading.Lock()
+
+
+def _inflight_registry() -> Dict[str, "asyncio.Future[List[float]]"]:
+    loop = asyncio.get_running_loop()
+    with _inflight_lock:
+        registry = _inflight.get(loop)
+        if registry is None:
+            registry = _inflight[loop] = {}
+        return registry
+
+
+def _drop_registry_if_empty(registry: Dict[str, "asyncio.Future[List[float]]"]):
+    if registry:
+        return
+    loop = asyncio.get_running_loop()
+    with _inflight_lock:
+        if _inflight.get(loop) is registry:
+            del _inflight[loop]
+
+
+def _settle(fut: "asyncio.Future[List[float]]", vec: Optional[List[float]] = None, err: Optional[BaseException] = None):
+    if fut.done():
+        return
+    if err is None:
+        fut.set_result(vec)  # type: ignore[arg-type]
+    else:
+        fut.set_exception(err)
+        # Mark retrieved so followers-less failures don't log "exception was never retrieved"
+        fut.exception()
+
+
+async def embed_batched_iter(
     texts: Sequence[str],
     model: str = DEFAULT_MODEL,
     batch_size: int = 256,
@@ -35,38 +138,84 @@ async def embed_batched_async(
     max_retries: int = 6,
     on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
     max_tokens_per_batch: Optional[int] = None,
-) -> Tuple[List[List[float]], int]:
-    """Embed texts efficiently with batching, concurrency, caching and retries.
+    max_concurrency_cap: Optional[int] = 32,
+    dimensions: Optional[int] = None,
+    reuse_full: bool = True,
+) -> AsyncIterator[Tuple[List[int], List[List[float]]]]:
+    """Streaming variant of embed_batched_async.
 
-    Parameters:
-    - texts: input strings
-    - model: embedding model name
-    - batch_size: max number of items per batch (upper bound even when token-batching)
-    - max_concurrency: simultaneous batches to process
-    - cache: optional EmbeddingCache instance
-    - max_retries: per-batch retry attempts for transient errors
-    - on_progress: optional callback receiving a dict with metrics, e.g.
-        {stage, total, done, cache_hits, scheduled, batch_idx, batch_size, batch_tokens, retries_total, elapsed_sec}
-    - max_tokens_per_batch: if set, build batches by token budget using first-fit decreasing (FFD)
-    Returns: (vectors, dim)
+    Yields (indices, vectors) pairs: first one group with all cache hits (if any), then one
+    per API batch in completion order. Indices refer to positions in `texts`.
+    Duplicate texts are embedded once and fanned back out to every index; texts already
+    being embedded by another in-flight call on the same loop are awaited, not re-sent.
+    Closing the iterator early cancels batches that are still in flight.
+    Parameters and on_progress events are the same as for embed_batched_async.
     """
     t0 = time.perf_counter()
     logger = logging.getLogger(__name__)
     # Cache lookup
-    keys = [hash_key(model, t) for t in texts]
+    dimensions = int(dimensions) if dimensions else None
+    keys = [hash_key(model, t, dimensions) for t in texts]
     cached: dict[str, List[float]] = {}
     if cache:
         for k, vec in cache.get_many(keys):
-            cached[k] = vec
-    to_embed: List[Tuple[int, str]] = [(i, t) for i, (k, t) in enumerate(zip(keys, texts)) if k not in cached]
-    out: List[List[float]] = [None] * len(texts)  # type: ignore
-    # Fill cached
-    for i, t in enumerate(texts):
-        k = keys[i]
-        if k in cached:
-            out[i] = cached[k]
+            # Cache rows decode straight to float32 arrays; tolist() is a single C-level copy
+            cached[k] = vec.tolist()
+        if dimensions and reuse_full:
+            # Shorten cached full-size vectors locally instead of paying for a new API call
+            full_of = {hash_key(model, t): k for t, k in zip(texts, keys) if k not in cached}
+            for fk, vec in cache.get_many(list(full_of)):
+                if len(vec) >= dimensions:
+                    cached[full_of[fk]] = truncate_embedding(vec.tolist(), dimensions)
+    hit_idx = [i for i, k in enumerate(keys) if k in cached]
+    cache_hits = len(hit_idx)
+    # Yield hits before registering any in-flight futures: a consumer may close the iterator
+    # here, and nothing outside the try/finally below may be left owned in the registry
+    if hit_idx:
+        yield hit_idx, [cached[keys[i]] for i in hit_idx]
+    # Dedupe misses by key: embed the first occurrence, fan the vector out to the rest
+    groups: Dict[str, List[int]] = {}
+    for i, k in enumerate(keys):
+        if k not in cached:
+            groups.setdefault(k, []).append(i)
+    registry = _inflight_registry()
+    owned: Dict[str, "asyncio.Future[List[float]]"] = {}
+    to_embed: List[Tuple[int, str]] = []
+    following: List[Tuple[int, "asyncio.Future[List[float]]"]] = []
+    for k, idxs in groups.items():
+        pending = registry.get(k)
+        if pending is not None and not pending.done():
+            following.append((idxs[0], pending))
+            continue
+        fut = asyncio.get_running_loop().create_future()
+        registry[k] = fut
+        owned[k] = fut
+        to_embed.append((idxs[0], texts[idxs[0]]))
+    if not owned:
+        _drop_registry_if_empty(registry)
+
+    def _fan_out(first_idxs: List[int], vecs: List[List[float]]) -> Tuple[List[int], List[List[float]]]:
+        all_idx: List[int] = []
+        all_vecs: List[List[float]] = []
+        for i, v in zip(first_idxs, vecs):
+            for j in groups[keys[i]]:
+                all_idx.append(j)
+                all_vecs.append(v)
+        return all_idx, all_vecs
+
+    def _release_owned(first_idxs: Optional[List[int]] = None, vecs=None, err: Optional[BaseException] = None):
+        ks = [keys[i] for i in first_idxs] if first_idxs is not None else list(owned)
+        for n, k in enumerate(ks):
+            fut = owned.pop(k, None)
+            if fut is None:
+                continue
+            if registry.get(k) is fut:
+                del registry[k]
+            _settle(fut, vecs[n] if vecs is not None else None, err)
+        _drop_registry_if_empty(registry)
+
     # Early return if all cached
-    if not to_embed:
+    if not to_embed and not following:
         # Report progress if callback provided
         if on_progress:
             try:
@@ -81,129 +230,152 @@ async def embed_batched_async(
                 })
             except Exception:
                 pass
-        return out, (len(out[0]) if out and out[0] else 0)
+        return
 
     # Guardrails
     batch_size = max(1, int(batch_size or 1))
     max_concurrency = max(1, int(max_concurrency or 1))
 
-    sem = asyncio.Semaphore(max_concurrency)
+    cap = int(max_concurrency_cap) if max_concurrency_cap else max_concurrency
+    # One window per (loop, model, API key), shared with concurrent and later calls
+    limiter = shared_limiter(
+        RateLimiter.bucket_key(os.getenv("OPENAI_API_KEY"), model),
+        initial=max_concurrency,
+        maximum=max(max_concurrency, cap),
+    )
     retries_total = 0
+    done_count = cache_hits
 
     # Build batches: either fixed-size by count, or length-aware by token budget
     batches: List[List[Tuple[int, str]]] = []
-    batch_tokens: List[int] = []
+    # Per-batch token totals, reused by the rate limiter (None: counted when the batch is sent)
+    batch_tokens: List[Optional[int]] = []
     if max_tokens_per_batch and max_tokens_per_batch > 0:
-        # compute token counts for non-cached texts
-        items = []  # (idx, text, tok)
-        for i, t in to_embed:
-            try:
-                tok = max(1, count_tokens(t))
-            except Exception:
-                tok = max(1, len(t.split()))
-            items.append((i, t, tok))
-        # First-Fit Decreasing packing
-        items.sort(key=lambda x: x[2], reverse=True)
-        for i, t, tok in items:
-            placed = False
-            for b_idx in range(len(batches)):
-                if batch_tokens[b_idx] + tok <= max_tokens_per_batch and len(batches[b_idx]) < batch_size:
-                    batches[b_idx].append((i, t))
-                    batch_tokens[b_idx] += tok
-                    placed = True
-                    break
-            if not placed:
-                batches.append([(i, t)])
-                batch_tokens.append(tok)
-        # Enforce batch_size cap by splitting oversized batches if any
-        fixed_batches: List[List[Tuple[int, str]]] = []
-        for b in batches:
-            for j in range(0, len(b), batch_size):
-                fixed_batches.append(b[j:j + batch_size])
-        batches = fixed_batches
+        # compute token counts for non-cached texts in one batched tokenizer call
+        try:
+            counts = count_tokens_many([t for _, t in to_embed])
+        except Exception:
+            counts = [len(t.split()) for _, t in to_embed]
+        items = [(i, t, max(1, tok)) for (i, t), tok in zip(to_embed, counts)]  # (idx, text, tok)
+        batches = pack_token_batches(items, max_tokens_per_batch, batch_size)
+        tok_of = {i: tok for i, _, tok in items}
+        batch_tokens = [sum(tok_of[i] for i, _ in b) for b in batches]
     else:
         # Simple slicing by count
         for i in range(0, len(to_embed), batch_size):
             batches.append(to_embed[i:i + batch_size])
+        batch_tokens = [None] * len(batches)
 
     if on_progress:
         try:
             on_progress({
                 "stage": "scheduled",
                 "total": len(texts),
-                "done": len(texts) - len(to_embed),
-                "cache_hits": len(texts) - len(to_embed),
+                "done": cache_hits,
+                "cache_hits": cache_hits,
                 "scheduled": sum(len(b) for b in batches),
                 "batches": len(batches),
+                "deduped": len(texts) - cache_hits - len(groups),
+                "shared_inflight": len(following),
             })
         except Exception:
             pass
 
-    async def worker(batch_idx: int, chunk: List[Tuple[int, str]]):
-        # Backoff loop inside each batch
+    def _emit(ev: Dict[str, Any]):
+        if on_progress:
+            try:
+                on_progress(ev)
+            except Exception:
+                pass
+
+    async def worker(batch_idx: int, chunk: List[Tuple[int, str]], tokens: Optional[int] = None):
+        nonlocal retries_total
         delay = 1.0
         attempts = 0
         while True:
+            await limiter.acquire()
+            err: Optional[Exception] = None
             try:
                 payload = [t for _, t in chunk]
-                vecs = await _embed_async(payload, model)
+                started = time.perf_counter()
+                vecs = await _embed_async(payload, model, dimensions, tokens)
                 # Defensive: ensure we got same count as payload
                 if not isinstance(vecs, list) or len(vecs) != len(payload):
                     raise RuntimeError(f"Embedding API returned {len(vecs) if isinstance(vecs, list) else 'invalid'} results for {len(payload)} inputs")
-                for (i, _), v in zip(chunk, vecs):
-                    out[i] = v
-                # Persist to cache
+                # Per-item latency so token-packed batches of different sizes compare fairly
+                limiter.on_success((time.perf_counter() - started) / max(1, len(payload)))
+            except Exception as e:
+                err = e
+            finally:
+                await limiter.release()
+            if err is None:
+                # Persist to cache off the event loop (the cache keeps one connection per thread)
+                first_idxs = [i for i, _ in chunk]
+                # Wake concurrent callers waiting on these keys before the cache write
+                _release_owned(first_idxs, vecs)
                 if cache and vecs:
                     dim = len(vecs[0])
-                    cache.put_many([(keys[i], v) for (i, _), v in zip(chunk, vecs)], dim)
-                # progress
-                if on_progress:
-                    try:
-                        on_progress({
-                            "stage": "batch_done",
-                            "batch_idx": batch_idx,
-                            "batch_size": len(chunk),
-                            "total": len(texts),
-                            "done": sum(1 for v in out if v is not None),
-                            "cache_hits": len(texts) - len(to_embed),
-                            "retries_total": retries_total,
-                        })
-                    except Exception:
-                        pass
-                return
-            except Exception as e:  # backoff on likely transient errors
-                attempts += 1
-                msg = str(e).lower()
-                transient = any(code in msg for code in [
-                    "429", "rate", "temporarily", "timeout", "5xx", "internal", "overloaded", "connection", "reset", "unavailable"
-                ])
-                if transient and attempts <= max_retries:
-                    jitter = random.uniform(0, max(0.1, delay * 0.2))
-                    await asyncio.sleep(delay + jitter)
-                    delay = min(30.0, delay * 2.0)
-                    retries_total += 1
-                    continue
-                raise
-
-    tasks = []
-    # Schedule batches
-    for b_idx, batch in enumerate(batches):
-        await sem.acquire()
-        tasks.append(asyncio.create_task(worker(b_idx, batch)))
-        tasks[-1].add_done_callback(lambda _t: sem.release())
-    if tasks:
-        await asyncio.gather(*tasks)
-    # Infer dim from any vector
-    dim = 0
-    for v in out:
-        if v is not None:
-            dim = len(v)
-            break
-    # Fill any None (shouldn't happen) with zero vectors
-    if dim:
-        for i, v in enumerate(out):
-            if v is None:
-                out[i] = [0.0] * dim
+                    await asyncio.to_thread(cache.put_many, [(keys[i], v) for (i, _), v in zip(chunk, vecs)], dim)
+                return batch_idx, first_idxs, vecs
+            # Backoff on likely transient errors; honour server-provided Retry-After
+            attempts += 1
+            transient, overload, retry_after = classify_error(err)
+            if overload and limiter.on_overload(retry_after):
+                _emit({"stage": "throttled", "concurrency": limiter.limit, "retry_after": retry_after})
+            if transient and attempts <= max_retries:
+                wait = retry_after if retry_after is not None else delay
+                jitter = random.uniform(0, max(0.1, wait * 0.2))
+                await asyncio.sleep(wait + jitter)
+                delay = min(30.0, delay * 2.0)
+                retries_total += 1
+                continue
+            _release_owned([i for i, _ in chunk], err=err)
+            raise err
+
+    async def follow(chunk: List[Tuple[int, "asyncio.Future[List[float]]"]]):
+        """Await vectors another call is already fetching; embed ourselves if that call fails."""
+        first_idxs = [i for i, _ in chunk]
+        try:
+            vecs = await asyncio.gather(*(asyncio.shield(f) for _, f in chunk))
+            return None, first_idxs, list(vecs)
+        except Exception:
+            return await worker(-1, [(i, texts[i]) for i in first_idxs])
+
+    # Schedule batches; the AIMD limiter inside worker bounds concurrency
+    tasks = [
+        asyncio.create_task(worker(b_idx, batch, batch_tokens[b_idx])) for b_idx, batch in enumerate(batches)
+    ]
+    for j in range(0, len(following), batch_size):
+        tasks.append(asyncio.create_task(follow(following[j:j + batch_size])))
+    try:
+        for fut in asyncio.as_completed(tasks):
+            batch_idx, first_idxs, vecs = await fut
+            idxs, vecs = _fan_out(first_idxs, vecs)
+            done_count += len(idxs)
+            # progress
+            if on_progress:
+                try:
+                    on_progress({
+                        "stage": "batch_done",
+                        "batch_idx": batch_idx,
+                        "batch_size": len(idxs),
+                        "shared": batch_idx is None,
+                        "total": len(texts),
+                        "done": done_count,
+                        "cache_hits": cache_hits,
+                        "retries_total": retries_total,
+                        "concurrency": limiter.limit,
+                    })
+                except Exception:
+                    pass
+            yield idxs, vecs
+    finally:
+        # Early close or failure: don't leave batches running in the background
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        # Followers on other calls must not wait forever for keys we no longer fetch
+        _release_owned(err=RuntimeError("embedding call was cancelled"))
     # Final metrics
     elapsed = time.perf_counter() - t0
     if on_progress:
@@ -212,9 +384,10 @@ async def embed_batched_async(
                 "stage": "done",
                 "total": len(texts),
                 "done": len(texts),
-                "cache_hits": len(texts) - len(to_embed),
+                "cache_hits": cache_hits,
                 "scheduled": sum(len(b) for b in batches),
                 "retries_total": retries_total,
+                "concurrency": limiter.limit,
                 "elapsed_sec": elapsed,
             })
         except Exception:
@@ -223,18 +396,81 @@ async def embed_batched_async(
     try:
         logger.debug(
             "embeddings: total=%d cache_hits=%d batches=%d retries=%d elapsed=%.2fs",
-            len(texts), len(texts) - len(to_embed), len(batches), retries_total, elapsed,
+            len(texts), cache_hits, len(batches), retries_total, elapsed,
         )
     except Exception:
         pass
+
+
+async def embed_batched_async(
+    texts: Sequence[str],
+    model: str = DEFAULT_MODEL,
+    batch_size: int = 256,
+    max_concurrency: int = 6,
+    cache: EmbeddingCache | None = None,
+    max_retries: int = 6,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    max_tokens_per_batch: Optional[int] = None,
+    max_concurrency_cap: Optional[int] = 32,
+    dimensions: Optional[int] = None,
+    reuse_full: bool = True,
+) -> Tuple[List[List[float]], int]:
+    """Embed texts efficiently with batching, concurrency, caching and retries.
+
+    Parameters:
+    - texts: input strings
+    - model: embedding model name
+    - batch_size: max number of items per batch (upper bound even when token-batching)
+    - max_concurrency: initial number of simultaneous batches
+    - max_concurrency_cap: upper bound for the adaptive (AIMD) window; the window grows while
+      latency stays flat and halves on 429/overload. None/0 keeps it fixed at max_concurrency
+    - cache: optional EmbeddingCache instance
+    - max_retries: per-batch retry attempts for transient errors
+    - on_progress: optional callback receiving a dict with metrics, e.g.
+        {stage, total, done, cache_hits, scheduled, batch_idx, batch_size, batch_tokens, retries_total, elapsed_sec,
+         concurrency, retry_after}
+    - max_tokens_per_batch: if set, build batches by token budget (best-fit decreasing, see pack_token_batches)
+    - dimensions: optional reduced output size (text-embedding-3-*); sent to the API and part of the cache key
+    - reuse_full: with `dimensions`, serve misses from cached full-size vectors by truncating locally
+    Returns: (vectors, dim)
+    """
+    out: List[List[float]] = [None] * len(texts)  # type: ignore
+    async for idxs, vecs in embed_batched_iter(
+        texts,
+        model=model,
+        batch_size=batch_size,
+        max_concurrency=max_concurrency,
+        cache=cache,
+        max_retries=max_retries,
+        on_progress=on_progress,
+        max_tokens_per_batch=max_tokens_per_batch,
+        max_concurrency_cap=max_concurrency_cap,
+        dimensions=dimensions,
+        reuse_full=reuse_full,
+    ):
+        for i, v in zip(idxs, vecs):
+            out[i] = v
+    # Infer dim from any vector
+    dim = 0
+    for v in out:
+        if v is not None:
+            dim = len(v)
+            break
+    # Fill any None (shouldn't happen) with zero vectors
+    if dim:
+        for i, v in enumerate(out):
+            if v is None:
+                out[i] = [0.0] * dim
     return out, dim
 
 
-def hash_key(model: str, text: str) -> str:
+def hash_key(model: str, text: str, dimensions: Optional[int] = None) -> str:
     from hashlib import sha256
 
     h = sha256()
-    h.update((model + "\n" + text).encode("utf-8", errors="ignore"))
+    # Full-size keys stay unchanged so existing cache rows remain valid
+    prefix = f"{model}@{int(dimensions)}" if dimensions else model
+    h.update((prefix + "\n" + text).encode("utf-8", errors="ignore"))
     return h.hexdigest()
 
 
@@ -243,47 +479,99 @@ def embed_texts(
     model: str = DEFAULT_MODEL,
     on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
     max_tokens_per_batch: Optional[int] = None,
+    dimensions: Optional[int] = None,
 ) -> List[List[float]]:
-    """Synchronous convenience wrapper that works both inside and outside running event loops.
-    Uses on-disk cache by default.
+    """Synchronous convenience wrapper; runs on the worker's long-lived embedding loop.
+    Uses the worker-wide cache (in-memory LRU in front of SQLite) by default.
     Optional on_progress callback receives dicts with {stage, done, total, ...}.
+    Works from plain threads and from threads that run their own event loop (e.g. Jupyter).
+    """
+    return submit_embeddings(
+        texts,
+        model=model,
+        on_progress=on_progress,
+        max_tokens_per_batch=max_tokens_per_batch,
+        dimensions=dimensions,
+    ).result()[0]
+
+
+def submit_embeddings(
+    texts: Sequence[str],
+    model: str = DEFAULT_MODEL,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    max_tokens_per_batch: Optional[int] = None,
+    dimensions: Optional[int] = None,
+) -> "Future[Tuple[List[List[float]], int]]":
+    """Schedule embed_batched_async on the background embedding loop.
+    Returns a concurrent.futures.Future resolving to (vectors, dim)."""
+    return get_background_loop().submit(
+        embed_batched_async(
+            texts,
+            model=model,
+            cache=get_shared_cache(),
+            on_progress=on_progress,
+            max_tokens_per_batch=max_tokens_per_batch,
+            dimensions=dimensions,
+        )
+    )
+
+
+def iter_embed_texts(
+    texts: Sequence[str],
+    model: str = DEFAULT_MODEL,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    max_tokens_per_batch: Optional[int] = None,
+    dimensions: Optional[int] = None,
+) -> Iterator[Tuple[List[int], List[List[float]]]]:
+    """Synchronous counterpart of embed_batched_iter for request handlers.
+
+    Yields (indices, vectors) as batches complete so callers can index incrementally.
+    The async iterator runs on the background embedding loop; closing this generator stops it.
+    on_progress is called on the consuming thread, never on the shared loop, so callbacks
+    may block (e.g. write job events to SQLite) without stalling other embedding calls.
     """
-    cache = EmbeddingCache()
+    cache = get_shared_cache()
+    q: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    async def _consume():
+        agen = embed_batched_iter(
+            texts,
+            model=model,
+            cache=cache,
+            on_progress=(lambda ev: q.put(("progress", ev))) if on_progress else None,
+            max_tokens_per_batch=max_tokens_per_batch,
+            dimensions=dimensions,
+        )
+        try:
+            async for item in agen:
+                q.put(("item", item))
+                if stop.is_set():
+                    break
+        finally:
+            await agen.aclose()
+
+    def _finished(f: Future):
+        err = None if f.cancelled() else f.exception()
+        q.put(("error", err) if err is not None else ("end", None))
+
+    fut = get_background_loop().submit(_consume())
+    fut.add_done_callback(_finished)
     try:
-        return asyncio.run(
-            embed_batched_async(
-                texts,
-                model=model,
-                cache=cache,
-                on_progress=on_progress,
-                max_tokens_per_batch=max_tokens_per_batch,
-            )
-        )[0]
-    except RuntimeError:
-        # Likely called from a running event loop (e.g., Jupyter). Run in a fresh loop on a thread.
-        import threading
-        import queue as _queue
-
-        q: _queue.Queue = _queue.Queue(maxsize=1)
-
-        def _runner():
-            try:
-                res = asyncio.run(
-                    embed_batched_async(
-                        texts,
-                        model=model,
-                        cache=cache,
-                        on_progress=on_progress,
-                        max_tokens_per_batch=max_tokens_per_batch,
-                    )
-                )
-                q.put((True, res))
-            except Exception as e:  # pragma: no cover
-                q.put((False, e))
-
-        t = threading.Thread(target=_runner, daemon=True)
-        t.start()
-        ok, payload = q.get()
-        if ok:
-            return payload[0]
-        raise payload
+        while True:
+            kind, payload = q.get()
+            if kind == "item":
+                yield payload
+            elif kind == "progress":
+                try:
+                    on_progress(payload)  # type: ignore[misc]
+                except Exception:
+                    pass
+            elif kind == "error":
+                raise payload
+            else:
+                return
+    finally:
+        stop.set()
+        # Closed early: cancel the consumer too, so batches already in flight stop spending quota
+        fut.cancel()
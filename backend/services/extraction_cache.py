@@ -0,0 +1,277 @@
+from __future__ import annotations
+from typing import Iterator, List, Optional, Union
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from . import pdf_extractor as _pdfx
+from .pdf_extractor import Page
+
+
+# Defaults used by the /upload cleaning step; part of every cache key
+CLEAN_PARAMS = {"strip_headers_footers": {"min_ratio": 0.6, "band_lines": 3}, "dedupe_repeated_lines": {}}
+
+
+def file_sha256(src: Union[str, bytes, bytearray]) -> str:
+    """SHA-256 of raw bytes, or of a file path read in chunks."""
+    if isinstance(src, (bytes, bytearray)):
+        return hashlib.sha256(bytes(src)).hexdigest()
+    h = hashlib.sha256()
+    with open(src, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extraction_key(digest: str, engine: str, clean: bool) -> str:
+    """Cache key: file digest + extractor version + engine + cleaning parameters."""
+    params = json.dumps(
+        {"v": _pdfx.EXTRACTOR_VERSION, "engine": engine, "clean": CLEAN_PARAMS if clean else None},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(f"{digest}\n{params}".encode("utf-8")).hexdigest()
+
+
+class _Packer:
+    """Incremental _pack: pages are compressed as they arrive, so only the compressed
+    blob is held, never the Page objects."""
+
+    def __init__(self):
+        self._z = zlib.compressobj(6)
+        self._parts = [self._z.compress(b"[")]
+        self.n_pages = 0
+
+    def add(self, p: Page):
+        row = json.dumps([p.page, p.text or "", p.width, p.height], ensure_ascii=False, separators=(",", ":"))
+        self._parts.append(self._z.compress((("," if self.n_pages else "") + row).encode("utf-8")))
+        self.n_pages += 1
+
+    def finish(self) -> bytes:
+        self._parts.append(self._z.compress(b"]"))
+        self._parts.append(self._z.flush())
+        return b"".join(self._parts)
+
+
+def _pack(pages: List[Page]) -> bytes:
+    packer = _Packer()
+    for p in pages:
+        packer.add(p)
+    return packer.finish()
+
+
+def _unpack(blob: bytes) -> List[Page]:
+    rows = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return [Page(page=r[0], text=r[1], width=r[2], height=r[3]) for r in rows]
+
+
+class ExtractionCache:
+    """SQLite cache of extracted (and optionally cleaned) per-page text, keyed by content.
+
+    Rows hold the pages as zlib-compressed JSON; identical uploads from any worker hit the
+    same row regardless of file name. `max_bytes` bounds the stored (compressed) size by
+    dropping least-recently-used documents on insert.
+    """
+
+    def __init__(self, path: str = ".extraction_cache.sqlite3", max_bytes: Optional[int] = None, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = self._conn()
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, n_pages INTEGER NOT NULL, "
+                "data BLOB NOT NULL, size INTEGER NOT NULL, last_access INTEGER NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS extractions_last_access ON extractions (last_access)")
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")
+            self._local.db = db
+        return db
+
+    def get(self, key: str) -> Optional[List[Page]]:
+        db = self._conn()
+        row = db.execute("SELECT data FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            with db:
+                db.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (int(time.time()), key))
+        except sqlite3.OperationalError:
+            pass  # a busy writer elsewhere; the access stamp is best effort
+        return _unpack(row[0])
+
+    def put(self, key: str, pages: List[Page]):
+        self.put_packed(key, len(pages), _pack(pages))
+
+    def put_packed(self, key: str, n_pages: int, blob: bytes):
+        """Store an already packed document (see _Packer)."""
+        db = self._conn()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO extractions (key, n_pages, data, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, n_pages, sqlite3.Binary(blob), len(blob), int(time.time())),
+            )
+        if self.max_bytes:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop least-recently-used rows until the stored size is within max_bytes."""
+        if not self.max_bytes:
+            return 0
+        db = self._conn()
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        removed = 0
+        while total > self.max_bytes:
+            rows = db.execute("SELECT key, size FROM extractions ORDER BY last_access LIMIT 16").fetchall()
+            if not rows:
+                break
+            drop = []
+            for k, size in rows:
+                if total <= self.max_bytes:
+                    break
+                drop.append((k,))
+                total -= size
+            with db:
+                db.executemany("DELETE FROM extractions WHERE key = ?", drop)
+            removed += len(drop)
+        return removed
+
+    def stats(self) -> dict:
+        db = self._conn()
+        n, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        return {"documents": n, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+_shared: Optional[ExtractionCache] = None
+_shared_pid: Optional[int] = None
+_shared_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Process-wide cache at EXTRACTION_CACHE_PATH (EXTRACTION_CACHE_MAX_MB caps it, 0 = unbounded);
+    None when EXTRACTION_CACHE=0."""
+    global _shared, _shared_pid
+    if (os.getenv("EXTRACTION_CACHE", "1") or "1").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    pid = os.getpid()
+    if _shared is not None and _shared_pid == pid:
+        return _shared
+    with _shared_lock:
+        if _shared is None or _shared_pid != pid:
+            try:
+                max_mb = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "0") or 0)
+            except Exception:
+                max_mb = 0.0
+            _shared = ExtractionCache(
+                os.getenv("EXTRACTION_CACHE_PATH") or ".extraction_cache.sqlite3",
+                max_bytes=int(max_mb * 1024 * 1024) if max_mb > 0 else None,
+            )
+            _shared_pid = pid
+    return _shared
+
+
+def _lookup(data: Union[str, bytes, bytearray], engine: str, clean: bool, digest: Optional[str]):
+    """(cache, key, cached pages or None); cache is None when disabled or unavailable."""
+    try:
+        cache = get_extraction_cache()
+        if cache is None:
+            return None, "", None
+        key = extraction_key(digest or file_sha256(data), engine, clean)
+        return cache, key, cache.get(key)
+    except Exception:
+        logging.getLogger(__name__).warning("extraction cache unavailable", exc_info=True)
+        return None, "", None
+
+
+def _store(cache: Optional[ExtractionCache], key: str, pages: List[Page]):
+    if cache is None:
+        return
+    try:
+        cache.put(key, pages)
+    except Exception:
+        logging.getLogger(__name__).warning("extraction cache write failed", exc_info=True)
+
+
+def _store_packed(cache: Optional[ExtractionCache], key: str, packer: "_Packer"):
+    if cache is None:
+        return
+    try:
+        cache.put_packed(key, packer.n_pages, packer.finish())
+    except Exception:
+        logging.getLogger(__name__).warning("extraction cache write failed", exc_info=True)
+
+
+def cached_extract_pages(
+    data: Union[str, bytes, bytearray], engine: str = "pymupdf", clean: bool = True, digest: Optional[str] = None
+) -> List[Page]:
+    """extract_pages (+ strip_headers_footers/dedupe_repeated_lines when `clean`) through
+    the content-addressed cache. `data` is raw bytes or a file path; pass a known SHA-256 as
+    `digest` to skip hashing. Cache failures never block extraction."""
+    cache, key, hit = _lookup(data, engine, clean, digest)
+    if hit is not None:
+        return hit
+    pages = _pdfx.extract_pages(data, engine=engine)
+    if clean:
+        strip = CLEAN_PARAMS["strip_headers_footers"]
+        bp = _pdfx.scan_boilerplate(pages, min_ratio=strip["min_ratio"], band_lines=strip["band_lines"])
+        pages = list(_pdfx.iter_clean_pages(pages, bp))
+    _store(cache, key, pages)
+    return pages
+
+
+def iter_cached_pages(
+    data: Union[str, bytes, bytearray], engine: str = "pymupdf", clean: bool = True, digest: Optional[str] = None
+) -> Iterator[Page]:
+    """Streaming cached_extract_pages: pages are extracted and cleaned lazily
+    (pdf_extractor.iter_extract_clean or iter_pages) and compressed into the cache entry as
+    they are yielded. A consumer that stops early (e.g. at a character budget) still gets the
+    whole document cached: closing the iterator finishes the remaining pages into the entry."""
+    cache, key, hit = _lookup(data, engine, clean, digest)
+    if hit is not None:
+        yield from hit
+        return
+    if clean:
+        strip = CLEAN_PARAMS["strip_headers_footers"]
+        source = _pdfx.iter_extract_clean(data, engine=engine, min_ratio=strip["min_ratio"], band_lines=strip["band_lines"])
+    else:
+        source = _pdfx.iter_pages(data, engine)
+    if cache is None:
+        yield from source
+        return
+    packer = _Packer()
+    try:
+        for pg in source:
+            packer.add(pg)
+            yield pg
+    except GeneratorExit:
+        # Consumer stopped early: finish the rest so the entry holds the whole document
+        try:
+            for pg in source:
+                packer.add(pg)
+        except Exception:
+            logging.getLogger(__name__).warning("extraction cache fill failed", exc_info=True)
+        else:
+            _store_packed(cache, key, packer)
+        raise
+    _store_packed(cache, key, packer)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+# handler(payload, emit) -> JSON-serializable result; emit(event_dict) records progress
+Handler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], Any]
+
+_handlers: Dict[str, Handler] = {}
+
+
+def register_handler(kind: str, fn: Handler):
+    _handlers[kind] = fn
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except Exception:
+        return default
+
+
+class JobQueue:
+    """Persistent job queue in SQLite, shared by every worker process on the host.
+
+    Jobs carry a JSON payload and an optional `owner` pid: owned jobs are only claimed by
+    that process (their results live in its memory, e.g. in-process vector stores), the rest
+    by any worker. Progress events are appended to an `events` table so any process can
+    serve status polls and NDJSON streams. Running jobs whose heartbeat is older than
+    `stale_sec` are re-queued, or failed when they were owned by a process that is gone;
+    owned jobs still queued after `stale_sec` are failed too.
+    """
+
+    def __init__(self, path: str = ".jobs.sqlite3", stale_sec: float = 600.0, retention_sec: float = 86400.0):
+        self.path = path
+        self.stale_sec = float(stale_sec)
+        self.retention_sec = float(retention_sec)
+        self._local = threading.local()
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = self._conn()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "payload TEXT NOT NULL, result TEXT, error TEXT, owner INTEGER, created REAL NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS events (job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, seq))"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit; multi-statement updates open their own IMMEDIATE transaction
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")
+            self._local.db = db
+        return db
+
+    def _tx(self, fn):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(db)
+            db.execute("COMMIT")
+            return out
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], owner: Optional[int] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        body = json.dumps(payload, ensure_ascii=False)
+
+        def _insert(db):
+            db.execute(
+                "INSERT INTO jobs (id, kind, status, payload, owner, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, body, owner, now, now),
+            )
+            db.execute("INSERT INTO events (job_id, seq, event) VALUES (?, 0, ?)", (job_id, json.dumps({"type": QUEUED})))
+
+        self._tx(_insert)
+        self.purge()
+        return job_id
+
+    def claim(self, kinds: Iterable[str], owner: int) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """Atomically take the oldest queued job this process may run: (id, kind, payload)."""
+        kinds = list(kinds)
+        if not kinds:
+            return None
+        now = time.time()
+        marks = ",".join("?" for _ in kinds)
+
+        def _claim(db):
+            # Recover jobs whose worker stopped heartbeating
+            stale = now - self.stale_sec
+            db.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE status = ? AND updated < ? AND owner IS NULL",
+                (QUEUED, now, RUNNING, stale),
+            )
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status = ? AND updated < ? AND owner IS NOT NULL",
+                (ERROR, "worker stopped", now, RUNNING, stale),
+            )
+            # Pinned jobs whose owner never claimed them (it exited first) cannot run anywhere else
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status = ? AND updated < ? "
+                "AND owner IS NOT NULL AND owner != ?",
+                (ERROR, "worker stopped", now, QUEUED, stale, owner),
+            )
+            row = db.execute(
+                f"SELECT id, kind, payload FROM jobs WHERE status = ? AND kind IN ({marks}) "
+                "AND (owner IS NULL OR owner = ?) ORDER BY created LIMIT 1",
+                (QUEUED, *kinds, owner),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (RUNNING, now, row[0]))
+            return row
+
+        row = self._tx(_claim)
+        if row is None:
+            return None
+        self.emit(row[0], {"type": RUNNING})
+        return row[0], row[1], json.loads(row[2])
+
+    def emit(self, job_id: str, event: Dict[str, Any]):
+        """Append a progress event (also serves as the running job's heartbeat)."""
+        body = json.dumps(event, ensure_ascii=False, default=str)
+
+        def _append(db):
+            seq = db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM events WHERE job_id = ?", (job_id,)).fetchone()[0]
+            db.execute("INSERT INTO events (job_id, seq, event) VALUES (?, ?, ?)", (job_id, seq, body))
+            db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+
+        self._tx(_append)
+
+    def finish(self, job_id: str, result: Any):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, updated = ? WHERE id = ?",
+            (DONE, json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?", (ERROR, error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, kind, status, result, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "kind": row[1], "status": row[2], "created": row[5], "updated": row[6]}
+        if row[3] is not None:
+            job["result"] = json.loads(row[3])
+        if row[4]:
+            job["error"] = row[4]
+        return job
+
+    def events(self, job_id: str, after: int = -1, limit: int = 500) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self._conn().execute(
+            "SELECT seq, event FROM events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?", (job_id, after, limit)
+        ).fetchall()
+        return [(seq, json.loads(ev)) for seq, ev in rows]
+
+    def last_event(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT event FROM events WHERE job_id = ? ORDER BY seq DESC LIMIT 1", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def purge(self) -> int:
+        """Drop finished jobs (and their events) older than retention_sec."""
+        cutoff = time.time() - self.retention_sec
+
+        def _purge(db):
+            ids = [r[0] for r in db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND updated < ? LIMIT 500", (DONE, ERROR, cutoff)
+            ).fetchall()]
+            for job_id in ids:
+                db.execute("DELETE FROM events WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return len(ids)
+
+        return self._tx(_purge)
+
+
+class JobWorkers:
+    """Daemon threads in this process that claim and run jobs for the registered handlers.
+
+    Threads (not processes) so owned jobs update this worker's in-memory state; CPU-heavy
+    steps already fan out (PDF extraction uses its own process pool).
+    """
+
+    def __init__(self, queue: JobQueue, threads: int = 2, poll_sec: float = 0.5):
+        self.queue = queue
+        self.poll_sec = float(poll_sec)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True) for i in range(max(1, threads))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        log = logging.getLogger(__name__)
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(list(_handlers), os.getpid())
+            except Exception:
+                log.warning("job claim failed", exc_info=True)
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_sec)
+                self._wake.clear()
+                continue
+            self.run_one(*job)
+
+    def run_one(self, job_id: str, kind: str, payload: Dict[str, Any]):
+        log = logging.getLogger(__name__)
+
+        def emit(ev: Dict[str, Any]):
+            try:
+                self.queue.emit(job_id, ev)
+            except Exception:
+                log.debug("job event dropped", exc_info=True)
+
+        try:
+            result = _handlers[kind](payload, emit)
+        except Exception as e:
+            log.warning("job %s (%s) failed", job_id, kind, exc_info=True)
+            emit({"type": ERROR, "error": str(e)})
+            self.queue.fail(job_id, str(e))
+            return
+        self.queue.finish(job_id, result)
+
+
+_shared: Optional[JobQueue] = None
+_workers: Optional[JobWorkers] = None
+_shared_pid: Optional[int] = None
+_shared_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide queue at JOBS_PATH; worker threads (JOB_WORKERS, default 2) start with it."""
+    global _shared, _workers, _shared_pid
+    pid = os.getpid()
+    if _shared is not None and _shared_pid == pid:
+        return _shared
+    with _shared_lock:
+        if _shared is None or _shared_pid != pid:
+            _shared = JobQueue(
+                os.getenv("JOBS_PATH") or ".jobs.sqlite3",
+                stale_sec=_env_float("JOB_STALE_SEC", 600.0),
+                retention_sec=_env_float("JOB_RETENTION_SEC", 86400.0),
+            )
+            threads = int(_env_float("JOB_WORKERS", 2))
+            _workers = JobWorkers(_shared, threads=threads) if threads > 0 else None
+            _shared_pid = pid
+    return _shared
+
+
+def submit_job(kind: str, payload: Dict[str, Any], pin: bool = False) -> str:
+    """Enqueue a job; `pin=True` keeps it on this process (see JobQueue)."""
+    queue = get_job_queue()
+    job_id = queue.enqueue(kind, payload, owner=os.getpid() if pin else None)
+    if _workers is not None:
+        _workers.wake()
+    return job_id
@@ -0,0 +1,140 @@
+from __future__ import annotations
+from typing import Dict, Generic, Hashable, List, Optional, Sequence, Tuple, TypeVar
+import re
+import struct
+import hashlib
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+
+K = TypeVar("K", bound=Hashable)
+
+_PRIME = (1 << 31) - 1
+_WORD_RX = re.compile(r"\w+", re.UNICODE)
+
+
+def shingles(text: str, k: int = 5) -> List[int]:
+    """32-bit hashes of the distinct word k-shingles of `text` (case/punctuation-insensitive)."""
+    words = _WORD_RX.findall((text or "").lower())
+    if not words:
+        return []
+    if len(words) < k:
+        grams = {" ".join(words)}
+    else:
+        grams = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    out = []
+    for g in grams:
+        out.append(struct.unpack("<I", hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest())[0])
+    return out
+
+
+class MinHasher:
+    """MinHash signatures from universal hashes (a*x + b) mod (2^31 - 1)."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        gen = hashlib.blake2b(f"minhash:{seed}".encode("utf-8"))
+        self._a: List[int] = []
+        self._b: List[int] = []
+        for i in range(num_perm):
+            gen.update(struct.pack("<I", i))
+            a, b = struct.unpack("<II", gen.digest()[:8])
+            self._a.append(a % (_PRIME - 1) + 1)
+            self._b.append(b % _PRIME)
+        self.num_perm = num_perm
+        if np is not None:
+            self._na = np.asarray(self._a, dtype=np.uint64)
+            self._nb = np.asarray(self._b, dtype=np.uint64)
+
+    def signature(self, hashes: Sequence[int]) -> Tuple[int, ...]:
+        if not hashes:
+            return tuple([_PRIME] * self.num_perm)
+        if np is not None:
+            # a, x < 2^31, so a*x + b stays well inside uint64
+            x = np.asarray([h % _PRIME for h in hashes], dtype=np.uint64)[:, None]
+            hv = (x * self._na + self._nb) % np.uint64(_PRIME)
+            return tuple(int(v) for v in hv.min(axis=0))
+        xs = [h % _PRIME for h in hashes]
+        return tuple(min((a * x + b) % _PRIME for x in xs) for a, b in zip(self._a, self._b))
+
+
+def signature_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    if not a:
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class NearDuplicateIndex(Generic[K]):
+    """Incremental MinHash + LSH index that groups near-identical texts.
+
+    Signatures are split into `bands` bands; texts sharing any band bucket are candidates and
+    are grouped when their estimated Jaccard similarity reaches `threshold`. Each group keeps
+    one representative (the longest text seen, so the most complete slide of a build-up wins).
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = float(threshold)
+        self.shingle_size = int(shingle_size)
+        self.bands = int(bands)
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        self._sigs: List[Tuple[int, ...]] = []
+        # group id per added item; groups hold (representative item, members, rep length)
+        self._group_of: List[int] = []
+        self._groups: List[List] = []
+        self._keys: List[K] = []
+
+    def add(self, key: K, text: str) -> int:
+        """Add a text; returns its group id (new id if it is not a near-duplicate)."""
+        sig = self.hasher.signature(shingles(text, self.shingle_size))
+        item = len(self._sigs)
+        best: Optional[int] = None
+        best_sim = self.threshold
+        seen = set()
+        empty = not (text or "").strip()
+        for band in range(self.bands):
+            bucket = (band, sig[band * self.rows:(band + 1) * self.rows])
+            members = self._buckets.setdefault(bucket, [])
+            if not empty:
+                for other in members:
+                    if other in seen:
+                        continue
+                    seen.add(other)
+                    sim = signature_similarity(sig, self._sigs[other])
+                    if sim >= best_sim:
+                        best, best_sim = other, sim
+            members.append(item)
+        self._sigs.append(sig)
+        self._keys.append(key)
+        length = len(text or "")
+        if best is None:
+            gid = len(self._groups)
+            self._groups.append([item, [item], length])
+        else:
+            gid = self._group_of[best]
+            group = self._groups[gid]
+            group[1].append(item)
+            if length > group[2]:
+                group[0], group[2] = item, length
+        self._group_of.append(gid)
+        return gid
+
+    def groups(self) -> List[Tuple[K, List[K]]]:
+        """(representative key, member keys in insertion order) per group, ordered by first member."""
+        return [(self._keys[rep], [self._keys[m] for m in members]) for rep, members, _ in self._groups]
+
+
+def collapse_near_duplicates(
+    items: Sequence[Tuple[K, str]], threshold: float = 0.9, **kwargs
+) -> List[Tuple[K, List[K]]]:
+    """Group near-identical texts; returns (kept key, keys it stands in for) in document order."""
+    index: NearDuplicateIndex[K] = NearDuplicateIndex(threshold=threshold, **kwargs)
+    for key, text in items:
+        index.add(key, text)
+    return index.groups()
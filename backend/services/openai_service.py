@@ -1,16 +1,108 @@
+import asyncio
 import os
-from typing import Optional
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
 
 try:
     from openai import OpenAI  # type: ignore
 except Exception:
     OpenAI = None  # type: ignore
 
+try:
+    from openai import AsyncOpenAI  # type: ignore
+except Exception:
+    AsyncOpenAI = None  # type: ignore
 
-def get_client(api_key: Optional[str] = None):
-    if OpenAI is None:
-        raise RuntimeError("OpenAI SDK not installed")
+
+
+def _resolve_key(api_key: Optional[str]) -> str:
     key = (api_key or os.getenv("OPENAI_API_KEY") or "").strip()
     if not key:
         raise RuntimeError("Saknar API-nyckel. Ange en i panelen eller sätt OPENAI_API_KEY i .env.")
-    return OpenAI(api_key=key)
+    return key
+
+
+def get_client(api_key: Optional[str] = None):
+    if OpenAI is None:
+        raise RuntimeError("OpenAI SDK not installed")
+    return OpenAI(api_key=_resolve_key(api_key))
+
+
+_clients: Dict[Tuple[int, str], object] = {}
+_clients_lock = threading.Lock()
+
+
+def get_shared_client(api_key: Optional[str] = None):
+    """Reusable client per API key (and process), keeping its HTTP connection pool warm.
+    The sync OpenAI client is thread-safe, so worker threads can share it."""
+    if OpenAI is None:
+        raise RuntimeError("OpenAI SDK not installed")
+    key = _resolve_key(api_key)
+    ck = (os.getpid(), key)
+    client = _clients.get(ck)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(ck)
+            if client is None:
+                client = OpenAI(api_key=key)
+                _clients[ck] = client
+    return client
+
+
+# Loop -> {API key: AsyncOpenAI}. Keyed by the loop object (weakly) rather than id(loop), so a
+# new loop never inherits a client bound to a dead one; closed loops are pruned on lookup.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, object]]" = weakref.WeakKeyDictionary()
+
+
+def _async_http_client():
+    """Pooled keep-alive httpx client, HTTP/2 via the `h2` package from requirements.txt
+    (HTTP/1.1 when it is missing), or None for SDK defaults."""
+    try:
+        import httpx  # type: ignore
+        from openai import DefaultAsyncHttpxClient  # type: ignore
+    except Exception:
+        return None
+    try:
+        max_conns = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+    except Exception:
+        max_conns = 64
+    limits = httpx.Limits(max_connections=max_conns, max_keepalive_connections=max_conns, keepalive_expiry=60.0)
+    try:
+        return DefaultAsyncHttpxClient(http2=True, limits=limits)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        return DefaultAsyncHttpxClient(http2=False, limits=limits)
+    except Exception:
+        return None
+
+
+def get_shared_async_client(api_key: Optional[str] = None):
+    """AsyncOpenAI client per API key, bound to the running event loop.
+
+    Returns None when the async client isn't available so callers can fall back to the
+    sync client in a thread. Must be called from inside a running loop.
+    """
+    if AsyncOpenAI is None:
+        return None
+    key = _resolve_key(api_key)
+    # httpx async pools are tied to the loop that created them
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        for closed in [lp for lp in _async_clients.keys() if lp.is_closed()]:
+            del _async_clients[closed]
+        per_loop = _async_clients.get(loop)
+        if per_loop is None:
+            per_loop = _async_clients[loop] = {}
+        client = per_loop.get(key)
+        if client is None:
+            http_client = _async_http_client()
+            if http_client is not None:
+                client = AsyncOpenAI(api_key=key, http_client=http_client)
+            else:
+                client = AsyncOpenAI(api_key=key)
+            per_loop[key] = client
+    return client
@@ -1,14 +1,28 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import io
+import logging
+import multiprocessing
+import os
 import re
 import hashlib
+import threading
 
 try:
     import fitz  # PyMuPDF
 except Exception:  # pragma: no cover
     fitz = None  # type: ignore
 
+from .near_dup import collapse_near_duplicates
+from .tokenizer import count_tokens_many
+
+
+# Bump when extraction or cleaning output changes; part of extraction cache keys
+EXTRACTOR_VERSION = "1"
+
 
 @dataclass
 class Page:
@@ -26,78 +40,281 @@ def _read_doc(src: Union[str, bytes, bytearray]):
     return fitz.open(str(src))
 
 
-def extract_pages(src: Union[str, bytes, bytearray]) -> List[Page]:
+def _open_plumber(src: Union[str, bytes, bytearray]):
+    import pdfplumber
+
+    return pdfplumber.open(io.BytesIO(bytes(src)) if isinstance(src, (bytes, bytearray)) else str(src))
+
+
+# Extraction backends: "pymupdf" (default, layout-aware) and "pdfplumber" (slower fallback)
+ENGINES = ("pymupdf", "pdfplumber")
+
+
+def page_count(src: Union[str, bytes, bytearray], engine: str = "pymupdf") -> int:
+    if engine == "pdfplumber":
+        with _open_plumber(src) as pdf:
+            return len(pdf.pages)
+    doc = _read_doc(src)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def iter_pages(
+    src: Union[str, bytes, bytearray], engine: str = "pymupdf", start: int = 0, stop: Optional[int] = None
+) -> Iterator[Page]:
+    """Yield pages [start, stop) (0-based) one at a time, in order."""
+    if engine == "pdfplumber":
+        with _open_plumber(src) as pdf:
+            for i in range(start, len(pdf.pages) if stop is None else min(stop, len(pdf.pages))):
+                p = pdf.pages[i]
+                page = Page(page=i + 1, text=p.extract_text() or "", width=float(p.width), height=float(p.height))
+                # pdfplumber caches parsed layout objects per page; drop them as we go
+                p.close()
+                yield page
+        return
     doc = _read_doc(src)
-    pages: List[Page] = []
-    for i in range(len(doc)):
-        p = doc.load_page(i)
-        txt = p.get_text("text")  # layout-aware text
-        pages.append(Page(page=i + 1, text=txt or "", width=p.rect.width, height=p.rect.height))
-    return pages
+    try:
+        for i in range(start, len(doc) if stop is None else min(stop, len(doc))):
+            p = doc.load_page(i)
+            txt = p.get_text("text")  # layout-aware text
+            yield Page(page=i + 1, text=txt or "", width=p.rect.width, height=p.rect.height)
+    finally:
+        doc.close()
+
+
+def _extract_range(src: Union[str, bytes, bytearray], start: int, stop: int, engine: str = "pymupdf") -> List[Page]:
+    """Extract pages [start, stop); runs in worker processes too, so module-level."""
+    return list(iter_pages(src, engine, start, stop))
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except Exception:
+        return default
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_key: Optional[Tuple[int, int]] = None
+_pool_lock = threading.Lock()
+
+
+def _extract_pool(workers: int) -> ProcessPoolExecutor:
+    """Process-wide extraction pool (recreated after fork or when the size changes).
+
+    Uses forkserver where available: forking a threaded gunicorn worker directly can
+    inherit held locks.
+    """
+    global _pool, _pool_key
+    key = (os.getpid(), workers)
+    if _pool is not None and _pool_key == key:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None and _pool_key is not None and _pool_key[0] == os.getpid():
+                _pool.shutdown(wait=False)
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+            _pool_key = key
+    return _pool
+
+
+def _reset_pool():
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_key = None
+
+
+def extract_pages(
+    src: Union[str, bytes, bytearray],
+    workers: Optional[int] = None,
+    min_pages: Optional[int] = None,
+    engine: str = "pymupdf",
+) -> List[Page]:
+    """Extract text per page, in page order.
+
+    Documents with at least `min_pages` pages (PDF_PARALLEL_MIN_PAGES, default 64) are split
+    into disjoint page ranges that `workers` processes (PDF_EXTRACT_WORKERS, default up to 4)
+    open and extract independently. Smaller documents, workers <= 1 or a failing pool fall
+    back to extracting in the calling thread.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown PDF engine: {engine}")
+    if workers is None:
+        workers = _env_int("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1))
+    if min_pages is None:
+        min_pages = _env_int("PDF_PARALLEL_MIN_PAGES", 64)
+    n = page_count(src, engine)
+    workers = min(workers, n)
+    if n < max(1, min_pages) or workers <= 1:
+        return _extract_range(src, 0, n, engine)
+    step = -(-n // workers)
+    ranges = [(lo, min(n, lo + step)) for lo in range(0, n, step)]
+    try:
+        pool = _extract_pool(workers)
+        futures = [pool.submit(_extract_range, src, lo, hi, engine) for lo, hi in ranges]
+        pages: List[Page] = []
+        for fut in futures:
+            pages.extend(fut.result())
+        return pages
+    except BrokenProcessPool:
+        _reset_pool()
+        logging.getLogger(__name__).warning("PDF extraction pool broke; extracting in-process", exc_info=True)
+        return _extract_range(src, 0, n, engine)
 
 
 def _normalize_line(s: str) -> str:
     return re.sub(r"\s+", " ", s.strip())
 
 
-def strip_headers_footers(pages: List[Page], min_ratio: float = 0.6, band_lines: int = 3) -> List[Page]:
+@dataclass
+class Boilerplate:
+    """Lines to drop, from one statistics pass over a document (see scan_boilerplate)."""
+
+    top_ban: frozenset = frozenset()
+    bot_ban: frozenset = frozenset()
+    band_lines: int = 3
+    dedupe_ban: frozenset = frozenset()
+    strip: bool = True
+    dedupe: bool = True
+
+
+def scan_boilerplate(
+    pages: Iterable[Page],
+    min_ratio: float = 0.6,
+    band_lines: int = 3,
+    strip: bool = True,
+    dedupe: bool = True,
+) -> Boilerplate:
     """
-    Remove lines that repeat on >= min_ratio of pages within the first/last band_lines per page.
+    Single pass over (possibly streamed) pages collecting what strip_headers_footers and
+    dedupe_repeated_lines remove: lines repeating on >= min_ratio of pages within the
+    first/last band_lines, and short lines repeated many times across the document.
+    Global line counts are kept per band position, so the dedupe threshold is applied to
+    the counts that remain after header/footer stripping without a second look at the text.
     """
-    if not pages:
-        return pages
-    top_counts = {}
-    bot_counts = {}
-    total = len(pages)
-    # First pass: collect candidates
+    top_counts: dict = {}
+    bot_counts: dict = {}
+    # normalized line -> occurrences by raw position [middle, top band, bottom band, both]
+    line_counts: dict = {}
+    total = 0
     for pg in pages:
-        lines = [ln for ln in (pg.text or "").splitlines() if _normalize_line(ln)]
-        top = [
-            _normalize_line(ln) for ln in lines[: band_lines]
-        ]
-        bot = [
-            _normalize_line(ln) for ln in lines[-band_lines:]
-        ]
-        for ln in top:
-            top_counts[ln] = top_counts.get(ln, 0) + 1
-        for ln in bot:
-            bot_counts[ln] = bot_counts.get(ln, 0) + 1
-    top_ban = {ln for ln, c in top_counts.items() if c / total >= min_ratio}
-    bot_ban = {ln for ln, c in bot_counts.items() if c / total >= min_ratio}
-    # Second pass: filter
-    out: List[Page] = []
+        total += 1
+        lines = (pg.text or "").splitlines()
+        if strip:
+            nonblank = [n for n in (_normalize_line(ln) for ln in lines) if n]
+            for n in nonblank[:band_lines]:
+                top_counts[n] = top_counts.get(n, 0) + 1
+            for n in nonblank[-band_lines:]:
+                bot_counts[n] = bot_counts.get(n, 0) + 1
+        if dedupe:
+            bot_from = len(lines) - band_lines
+            for idx, ln in enumerate(lines):
+                n = _normalize_line(ln)
+                if not n:
+                    continue
+                slot = line_counts.get(n)
+                if slot is None:
+                    slot = line_counts[n] = [0, 0, 0, 0]
+                slot[(1 if strip and idx < band_lines else 0) + (2 if strip and idx >= bot_from else 0)] += 1
+    if not total:
+        return Boilerplate(band_lines=band_lines, strip=strip, dedupe=dedupe)
+    top_ban = frozenset(ln for ln, c in top_counts.items() if c / total >= min_ratio)
+    bot_ban = frozenset(ln for ln, c in bot_counts.items() if c / total >= min_ratio)
+    dedupe_ban = set()
+    threshold = max(5, total // 3)
+    for n, (mid, top, bot, both) in line_counts.items():
+        if len(n) > 80:
+            continue
+        in_top, in_bot = n in top_ban, n in bot_ban
+        kept = mid + (0 if in_top else top) + (0 if in_bot else bot) + (0 if in_top or in_bot else both)
+        if kept >= threshold:
+            dedupe_ban.add(n)
+    return Boilerplate(
+        top_ban=top_ban,
+        bot_ban=bot_ban,
+        band_lines=band_lines,
+        dedupe_ban=frozenset(dedupe_ban),
+        strip=strip,
+        dedupe=dedupe,
+    )
+
+
+def iter_clean_pages(pages: Iterable[Page], boilerplate: Boilerplate) -> Iterator[Page]:
+    """Lazily yield pages with the boilerplate lines removed."""
+    band = boilerplate.band_lines
+    top_ban, bot_ban, dedupe_ban = boilerplate.top_ban, boilerplate.bot_ban, boilerplate.dedupe_ban
+    chained = boilerplate.strip and boilerplate.dedupe
     for pg in pages:
         lines = (pg.text or "").splitlines()
+        bot_from = len(lines) - band
         keep: List[str] = []
+        stripped_blank = False
         for idx, ln in enumerate(lines):
             n = _normalize_line(ln)
-            if idx < band_lines and n in top_ban:
+            if idx < band and n in top_ban:
                 continue
-            if idx >= len(lines) - band_lines and n in bot_ban:
+            if idx >= bot_from and n in bot_ban:
+                continue
+            stripped_blank = ln == ""
+            if n in dedupe_ban:
                 continue
             keep.append(ln)
-        out.append(Page(page=pg.page, text="\n".join(keep), width=pg.width, height=pg.height))
-    return out
+        if chained and stripped_blank:
+            # Running the two steps separately re-splits the stripped text, which drops a
+            # trailing empty line; keep the output identical
+            keep.pop()
+        yield Page(page=pg.page, text="\n".join(keep), width=pg.width, height=pg.height)
+
+
+def strip_headers_footers(pages: List[Page], min_ratio: float = 0.6, band_lines: int = 3) -> List[Page]:
+    """
+    Remove lines that repeat on >= min_ratio of pages within the first/last band_lines per page.
+    """
+    if not pages:
+        return pages
+    bp = scan_boilerplate(pages, min_ratio=min_ratio, band_lines=band_lines, dedupe=False)
+    return list(iter_clean_pages(pages, bp))
 
 
 def dedupe_repeated_lines(pages: List[Page]) -> List[Page]:
     """Remove exact duplicate lines repeated many times across the document (naive global dedupe)."""
     if not pages:
         return pages
-    counts = {}
-    for pg in pages:
-        for ln in (pg.text or "").splitlines():
-            n = _normalize_line(ln)
-            if not n:
-                continue
-            counts[n] = counts.get(n, 0) + 1
-    # drop globally frequent short boilerplate
-    ban = {ln for ln, c in counts.items() if c >= max(5, len(pages) // 3) and len(ln) <= 80}
-    out: List[Page] = []
-    for pg in pages:
-        kept = [ln for ln in (pg.text or "").splitlines() if _normalize_line(ln) not in ban]
-        out.append(Page(page=pg.page, text="\n".join(kept), width=pg.width, height=pg.height))
-    return out
+    return list(iter_clean_pages(pages, scan_boilerplate(pages, strip=False)))
+
+
+def iter_extract_clean(
+    src: Union[str, bytes, bytearray],
+    engine: str = "pymupdf",
+    min_ratio: float = 0.6,
+    band_lines: int = 3,
+    buffer: Optional[bool] = None,
+) -> Iterator[Page]:
+    """
+    Streaming equivalent of extract_pages -> strip_headers_footers -> dedupe_repeated_lines.
+
+    Small documents are read twice, one page at a time: a statistics pass that keeps only
+    line counts, then a cleaning pass that yields pages as they are extracted, so memory stays
+    bounded by one page plus the counts. Documents with at least PDF_PARALLEL_MIN_PAGES pages
+    (or `buffer=True`) are extracted once by the parallel extract_pages and cleaned from the
+    buffered raw pages, trading memory for a single, multi-process extraction.
+    """
+    if buffer is None:
+        buffer = page_count(src, engine) >= max(1, _env_int("PDF_PARALLEL_MIN_PAGES", 64))
+    if buffer:
+        raw = extract_pages(src, engine=engine)
+        bp = scan_boilerplate(raw, min_ratio=min_ratio, band_lines=band_lines)
+        yield from iter_clean_pages(raw, bp)
+        return
+    bp = scan_boilerplate(iter_pages(src, engine), min_ratio=min_ratio, band_lines=band_lines)
+    yield from iter_clean_pages(iter_pages(src, engine), bp)
 
 
 def split_sentences(text: str) -> List[str]:
@@ -109,65 +326,100 @@ def split_sentences(text: str) -> List[str]:
     return [p.strip() for p in parts if p.strip()]
 
 
-def rolling_window_sentences(sentences: List[str], max_tokens: int, overlap: int, count_tokens) -> List[str]:
-    if not sentences:
+def sentence_windows(counts: Sequence[int], max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Greedy sentence windows as [lo, hi) index ranges over per-sentence token counts.
+
+    A window closes before the sentence that would push it past `max_tokens`; the next one
+    starts with the longest tail of the closed window that fits in `overlap` tokens. Both
+    window edges only move forward, so this is linear in the number of sentences.
+    """
+    if not counts:
         return []
-    chunks: List[str] = []
-    cur: List[str] = []
-    cur_tok = 0
-    for s in sentences:
-        t = max(1, count_tokens(s))
-        if cur and cur_tok + t > max_tokens:
-            chunks.append(" ".join(cur))
-            # overlap by sentence pieces until overlap token budget is satisfied
+    prefix = [0]
+    for c in counts:
+        prefix.append(prefix[-1] + max(1, c))
+    windows: List[Tuple[int, int]] = []
+    lo = 0
+    for i in range(len(counts)):
+        t = prefix[i + 1] - prefix[i]
+        if i > lo and prefix[i] - prefix[lo] + t > max_tokens:
+            windows.append((lo, i))
             if overlap > 0:
-                # keep from tail until reaching overlap tokens
-                tail: List[str] = []
-                tail_tok = 0
-                for seg in reversed(cur):
-                    tt = max(1, count_tokens(seg))
-                    if tail_tok + tt > overlap:
-                        break
-                    tail.append(seg)
-                    tail_tok += tt
-                cur = list(reversed(tail))
-                cur_tok = sum(max(1, count_tokens(seg)) for seg in cur)
+                # Smallest tail start whose suffix sum fits the overlap budget
+                while prefix[i] - prefix[lo] > overlap:
+                    lo += 1
             else:
-                cur = []
-                cur_tok = 0
-        cur.append(s)
-        cur_tok += t
-    if cur:
-        chunks.append(" ".join(cur))
-    return chunks
+                lo = i
+    windows.append((lo, len(counts)))
+    return windows
+
+
+def rolling_window_sentences(
+    sentences: List[str],
+    max_tokens: int,
+    overlap: int,
+    count_tokens=None,
+    counts: Optional[Sequence[int]] = None,
+) -> List[str]:
+    """Join sentences into overlapping windows (see sentence_windows).
+
+    Pass precomputed `counts` to skip tokenization; otherwise each sentence is counted once
+    with `count_tokens`, or in one batch via tokenizer.count_tokens_many.
+    """
+    if not sentences:
+        return []
+    if counts is None:
+        counts = [count_tokens(s) for s in sentences] if count_tokens else count_tokens_many(sentences)
+    return [" ".join(sentences[lo:hi]) for lo, hi in sentence_windows(counts, max_tokens, overlap)]
 
 
 def pages_to_chunks(
     pages: List[Page],
-    count_tokens,
+    count_tokens: Optional[Callable[[str], int]] = None,
     min_tokens: int = 500,
     max_tokens: int = 900,
     overlap_ratio: float = 0.12,
+    near_dup_threshold: float = 0.0,
 ) -> List[Tuple[str, dict]]:
     """
     Convert cleaned pages to token-aware chunks. Each chunk carries minimal metadata.
     Returns list of (text, meta) where meta has {doc, page, title, idx} if available.
+    Every sentence is tokenized exactly once (in one tokenizer.count_tokens_many batch unless
+    a custom `count_tokens` callable is given); window and merge sizes come from prefix sums
+    of those counts and are stored as meta["tokens"].
+    With near_dup_threshold > 0, near-identical pages are collapsed first (near_dup); meta["pages"]
+    lists the page numbers each chunk stands in for.
     """
     overlap = int(max_tokens * max(0.0, min(0.5, overlap_ratio)))
+    covers = {}
+    if near_dup_threshold > 0 and len(pages) > 1:
+        groups = collapse_near_duplicates(list(enumerate(p.text or "" for p in pages)), threshold=near_dup_threshold)
+        covers = {pages[rep].page: sorted(pages[m].page for m in members) for rep, members in groups}
+        pages = [pages[rep] for rep, _ in groups]
+    page_sents = [split_sentences(pg.text) for pg in pages]
+    flat = [s for sents in page_sents for s in sents]
+    flat_counts = [count_tokens(s) for s in flat] if count_tokens else count_tokens_many(flat)
     chunks: List[Tuple[str, dict]] = []
     idx = 0
-    for pg in pages:
-        sents = split_sentences(pg.text)
-        pieces = rolling_window_sentences(sents, max_tokens=max_tokens, overlap=overlap, count_tokens=count_tokens)
-        for piece in pieces:
+    offset = 0
+    for pg, sents in zip(pages, page_sents):
+        counts = [max(1, c) for c in flat_counts[offset:offset + len(sents)]]
+        offset += len(sents)
+        prefix = [0]
+        for c in counts:
+            prefix.append(prefix[-1] + c)
+        for lo, hi in sentence_windows(counts, max_tokens, overlap):
+            piece = " ".join(sents[lo:hi])
+            piece_tok = prefix[hi] - prefix[lo]
             # ensure lower bound: if under min_tokens and we have next, try to merge greedily
-            if count_tokens(piece) < min_tokens and chunks:
+            if piece_tok < min_tokens and chunks:
                 prev_txt, prev_meta = chunks[-1]
-                merged = prev_txt + "\n\n" + piece
-                if count_tokens(merged) <= max_tokens + overlap:
-                    chunks[-1] = (merged, prev_meta)
+                if prev_meta["tokens"] + piece_tok <= max_tokens + overlap:
+                    prev_meta["tokens"] += piece_tok
+                    prev_meta["pages"] = sorted(set(prev_meta["pages"]) | set(covers.get(pg.page, [pg.page])))
+                    chunks[-1] = (prev_txt + "\n\n" + piece, prev_meta)
                     continue
-            meta = {"page": pg.page, "idx": idx}
+            meta = {"page": pg.page, "idx": idx, "tokens": piece_tok, "pages": covers.get(pg.page, [pg.page])}
             chunks.append((piece, meta))
             idx += 1
     return chunks
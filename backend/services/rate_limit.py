@@ -0,0 +1,232 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .tokenizer import count_tokens, count_tokens_many
+
+
+# Conservative tier-1 style defaults (requests/min, tokens/min); override via env
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "text-embedding-3-large": (3000.0, 1_000_000.0),
+    "text-embedding-3-small": (3000.0, 1_000_000.0),
+    "text-embedding-ada-002": (3000.0, 1_000_000.0),
+}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except Exception:
+        return default
+
+
+def estimate_chat_tokens(messages: Optional[Sequence[Any]], max_completion: Any = 0) -> int:
+    """Rough prompt + completion budget for a chat call (what the API counts against TPM)."""
+    total = 0
+    for m in messages or []:
+        content = m.get("content") if isinstance(m, dict) else getattr(m, "content", None)
+        if isinstance(content, list):
+            content = "".join(
+                (it.get("text") or "") if isinstance(it, dict) else str(it) for it in content
+            )
+        try:
+            total += count_tokens(str(content or "")) + 4
+        except Exception:
+            total += len(str(content or "")) // 4 + 4
+    try:
+        total += int(max_completion or 0)
+    except Exception:
+        pass
+    return max(1, total)
+
+
+def estimate_texts_tokens(texts: Iterable[str]) -> int:
+    texts = list(texts)
+    try:
+        total = sum(count_tokens_many(texts))
+    except Exception:
+        total = sum(len(t) // 4 for t in texts)
+    return max(1, total)
+
+
+class RateLimitExceeded(RuntimeError):
+    """Capacity would free up only after more than `max_wait` seconds; maps to HTTP 429.
+
+    Raised instead of sleeping so a request thread never outlives the gunicorn worker timeout.
+    """
+
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OpenAI rate limit reached; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests/min and tokens/min, keyed by (API key, model).
+
+    Bucket state lives in a small SQLite file so every gunicorn worker on the host draws from
+    the same budget. Callers reserve capacity up front (balances may go negative) and sleep
+    until their reservation is covered, so concurrent callers queue in arrival order instead
+    of all firing and collecting 429s. A caller that would have to wait longer than `max_wait`
+    gets RateLimitExceeded and its reservation is not booked.
+    """
+
+    def __init__(self, path: str = ".openai_ratelimit.sqlite3", max_wait: float = 20.0):
+        self.path = path
+        self.max_wait = float(max_wait)
+        self.limits: Dict[str, Tuple[float, float]] = dict(DEFAULT_LIMITS)
+        self.default_limits = (_env_float("OPENAI_RPM", 500.0), _env_float("OPENAI_TPM", 200_000.0))
+        try:
+            for model, cfg in (json.loads(os.getenv("OPENAI_RATE_LIMITS") or "{}") or {}).items():
+                rpm, tpm = self.limits.get(model, self.default_limits)
+                self.limits[model] = (float(cfg.get("rpm", rpm)), float(cfg.get("tpm", tpm)))
+        except Exception:
+            logging.getLogger(__name__).warning("OPENAI_RATE_LIMITS is not valid JSON; ignoring")
+        self.waits = 0
+        self.waited_sec = 0.0
+        self._local = threading.local()
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = self._conn()
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, req REAL NOT NULL, tok REAL NOT NULL, ts REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit; reserve() opens its own IMMEDIATE transaction
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")
+            self._local.db = db
+        return db
+
+    def limits_for(self, model: str) -> Tuple[float, float]:
+        return self.limits.get(model, self.default_limits)
+
+    @staticmethod
+    def bucket_key(api_key: Optional[str], model: str) -> str:
+        # Never persist the raw key
+        digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return f"{digest}:{model}"
+
+    def reserve(self, api_key: Optional[str], model: str, tokens: int, max_wait: Optional[float] = None) -> float:
+        """Take one request and `tokens` from the bucket; return seconds to wait before calling.
+        Raises RateLimitExceeded, leaving the bucket untouched, when the wait exceeds `max_wait`."""
+        rpm, tpm = self.limits_for(model)
+        if rpm <= 0 and tpm <= 0:
+            return 0.0
+        key = self.bucket_key(api_key, model)
+        # A single call larger than the whole minute budget can never fit; cap it
+        need = float(min(max(1, int(tokens or 1)), tpm)) if tpm > 0 else 0.0
+        db = self._conn()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT req, tok, ts FROM buckets WHERE key = ?", (key,)).fetchone()
+            req, tok, ts = row if row else (rpm, tpm, now)
+            elapsed = max(0.0, now - ts)
+            req = min(rpm, req + elapsed * rpm / 60.0) if rpm > 0 else 0.0
+            tok = min(tpm, tok + elapsed * tpm / 60.0) if tpm > 0 else 0.0
+            req -= 1.0 if rpm > 0 else 0.0
+            tok -= need
+            wait = 0.0
+            if rpm > 0 and req < 0:
+                wait = max(wait, -req * 60.0 / rpm)
+            if tpm > 0 and tok < 0:
+                wait = max(wait, -tok * 60.0 / tpm)
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceeded(wait)
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (key, req, tok, ts) VALUES (?, ?, ?, ?)", (key, req, tok, now)
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _record(self, wait: float) -> float:
+        if wait > 0:
+            self.waits += 1
+            self.waited_sec += wait
+        return wait
+
+    def acquire(self, api_key: Optional[str], model: str, tokens: int) -> float:
+        """Blocking: reserve and sleep until the reservation is covered. Returns seconds waited."""
+        wait = self._record(self.reserve(api_key, model, tokens, self.max_wait))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, api_key: Optional[str], model: str, tokens: int) -> float:
+        # reserve() takes a SQLite write lock (busy timeout up to 10 s); keep it off the event loop
+        wait = self._record(await asyncio.to_thread(self.reserve, api_key, model, tokens, self.max_wait))
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+_shared: Optional[RateLimiter] = None
+_shared_pid: Optional[int] = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Process-wide limiter backed by OPENAI_RATE_LIMIT_PATH; None when OPENAI_RATE_LIMIT=0.
+    OPENAI_RATE_LIMIT_MAX_WAIT (default 20 s) must stay well below the gunicorn worker timeout."""
+    global _shared, _shared_pid
+    if (os.getenv("OPENAI_RATE_LIMIT", "1") or "1").strip().lower() in {"0", "false", "no", "off"}:
+        return None
+    pid = os.getpid()
+    if _shared is not None and _shared_pid == pid:
+        return _shared
+    with _shared_lock:
+        if _shared is None or _shared_pid != pid:
+            _shared = RateLimiter(
+                os.getenv("OPENAI_RATE_LIMIT_PATH") or ".openai_ratelimit.sqlite3",
+                max_wait=_env_float("OPENAI_RATE_LIMIT_MAX_WAIT", 20.0),
+            )
+            _shared_pid = pid
+    return _shared
+
+
+def throttle(api_key: Optional[str], model: str, tokens: int) -> float:
+    """Wait for rate-limit capacity before an OpenAI call. Raises RateLimitExceeded (HTTP 429)
+    when the wait would exceed max_wait; other limiter problems must not break the call itself."""
+    try:
+        limiter = get_rate_limiter()
+        if limiter is None:
+            return 0.0
+        return limiter.acquire(api_key or os.getenv("OPENAI_API_KEY"), model, tokens)
+    except RateLimitExceeded:
+        raise
+    except Exception:
+        logging.getLogger(__name__).warning("rate limiter unavailable", exc_info=True)
+        return 0.0
+
+
+async def throttle_async(api_key: Optional[str], model: str, tokens: int) -> float:
+    try:
+        limiter = get_rate_limiter()
+        if limiter is None:
+            return 0.0
+        return await limiter.acquire_async(api_key or os.getenv("OPENAI_API_KEY"), model, tokens)
+    except RateLimitExceeded:
+        raise
+    except Exception:
+        logging.getLogger(__name__).warning("rate limiter unavailable", exc_info=True)
+        return 0.0
@@ -18,17 +18,31 @@ def build_faiss(dim: int, kind: str = "hnsw") -> FaissIndex:
     return FaissIndex(dim=dim, kind=kind)
 
 
-def index_corpus(index: FaissIndex, ids: List[str], texts: List[str], metas: List[Optional[dict]], model: str) -> int:
-    vecs = embed_texts(texts, model=model)
+def index_corpus(
+    index: FaissIndex,
+    ids: List[str],
+    texts: List[str],
+    metas: List[Optional[dict]],
+    model: str,
+    dimensions: Optional[int] = None,
+) -> int:
+    vecs = embed_texts(texts, model=model, dimensions=dimensions)
     if not vecs:
         return 0
-    dim = len(vecs[0])
+    dim = min(len(vecs[0]), index.dim)
     index.add([AnnItem(id=i, vector=v, meta=m) for i, v, m in zip(ids, vecs, metas)])
     return dim
 
 
-def ann_query(index: FaissIndex, query: str, raw_top_k: int = 100, model: str = "text-embedding-3-large") -> List[Tuple[str, float]]:
-    qv = embed_texts([query], model=model)[0]
+def ann_query(
+    index: FaissIndex,
+    query: str,
+    raw_top_k: int = 100,
+    model: str = "text-embedding-3-large",
+    dimensions: Optional[int] = None,
+) -> List[Tuple[str, float]]:
+    # Full-size query vectors are truncated to index.dim by the index itself
+    qv = embed_texts([query], model=model, dimensions=dimensions)[0]
     hits = index.search(qv, top_k=raw_top_k)
     return [(hid, score) for hid, score, _ in hits]
 
@@ -41,8 +55,9 @@ def ann_query_mmr(
     raw_top_k: int = 100,
     final_k: int = 10,
     lambda_param: float = 0.7,
+    dimensions: Optional[int] = None,
 ) -> List[Retrieved]:
-    qv = embed_texts([query], model=model)[0]
+    qv = embed_texts([query], model=model, dimensions=dimensions)[0]
     # get raw hits
     import numpy as np
 
@@ -52,7 +67,7 @@ def ann_query_mmr(
         text, meta, vec = corpus_lookup.get(hid, ("", None, []))
         if not text or not vec:
             continue
-        items.append((hid, float(score), meta, vec))
+        items.append((hid, float(score), meta, vec[: index.dim]))
     # mmr select
     sel = mmr_select(items, top_k=final_k, lambda_param=lambda_param)
     return [Retrieved(id=i, score=s, text=corpus_lookup[i][0], meta=corpus_lookup[i][1]) for i, s, _ in sel]
@@ -1,4 +1,9 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+import os
+import re
+import threading
 
 try:
     import tiktoken  # type: ignore
@@ -6,48 +11,167 @@ except Exception:
     tiktoken = None  # type: ignore
 
 
+# Encoders resolved once per model name; tiktoken's own cache still pays for the
+# model -> encoding lookup (and a failed encoding_for_model) on every call
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+# Below this many texts a thread pool costs more than it saves
+BATCH_MIN_TEXTS = 32
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+
+def get_encoder(model: str = "cl100k_base"):
+    """Cached tiktoken encoding for a model or encoding name (None without tiktoken)."""
+    if tiktoken is None:
+        return None
+    enc = _encoders.get(model)
+    if enc is not None:
+        return enc
+    with _encoders_lock:
+        enc = _encoders.get(model)
+        if enc is None:
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except Exception:
+                try:
+                    enc = tiktoken.get_encoding(model)
+                except Exception:
+                    enc = tiktoken.get_encoding("cl100k_base")
+            _encoders[model] = enc
+    return enc
+
+
+def _num_threads() -> int:
+    """TOKENIZER_THREADS, defaulting to the CPU count capped at 8."""
+    default = min(8, os.cpu_count() or 1)
+    try:
+        return max(1, int(os.getenv("TOKENIZER_THREADS") or default))
+    except Exception:
+        return default
+
+
+def _thread_pool() -> ThreadPoolExecutor:
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _encoders_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=_num_threads(), thread_name_prefix="tokenizer")
+                _pool_pid = pid
+    return _pool
+
+
+def encode_many(texts: Sequence[str], model: str = "cl100k_base", num_threads: Optional[int] = None) -> List[List[int]]:
+    """Token ids for many texts in one call.
+
+    Like tiktoken's encode_ordinary_batch (the BPE core releases the GIL), but on a
+    persistent pool and one task per slice of texts rather than per text, which is what
+    dominates for sentence-sized inputs. Special-token markup is encoded as plain text.
+    """
+    texts = [t or "" for t in texts]
+    enc = get_encoder(model)
+    if enc is None:
+        raise RuntimeError("tiktoken is not installed")
+    threads = min(num_threads or _num_threads(), len(texts) // BATCH_MIN_TEXTS)
+    if threads <= 1:
+        return [enc.encode_ordinary(t) for t in texts]
+    step = -(-len(texts) // threads)
+    slices = [texts[i:i + step] for i in range(0, len(texts), step)]
+    out: List[List[int]] = []
+    for part in _thread_pool().map(lambda ts: [enc.encode_ordinary(t) for t in ts], slices):
+        out.extend(part)
+    return out
+
+
+def count_tokens_many(texts: Sequence[str], model: str = "cl100k_base", num_threads: Optional[int] = None) -> List[int]:
+    """Token counts for many texts; same values as count_tokens() per text."""
+    texts = list(texts)
+    if tiktoken is None:
+        return [count_tokens(t, model) for t in texts]
+    return [len(ids) for ids in encode_many(texts, model, num_threads)]
+
+
 def count_tokens(text: str, model: str = "cl100k_base") -> int:
     if not text:
         return 0
-    if tiktoken is not None:
-        try:
-            enc = tiktoken.encoding_for_model(model)
-        except Exception:
-            enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(text))
+    enc = get_encoder(model)
+    if enc is not None:
+        return len(enc.encode_ordinary(text))
     # naive fallback
     return max(1, len(text.split()))
 
 
-def chunk_text(text: str, max_tokens: int = 800, overlap: int = 100, model: str = "cl100k_base") -> List[str]:
+def _token_windows(n: int, max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    windows = []
+    start = 0
+    step = max(1, max_tokens - max(0, overlap))
+    while start < n:
+        windows.append((start, min(n, start + max_tokens)))
+        start += step
+    return windows
+
+
+def _byte_to_char_offsets(text: str, data: bytes, byte_offsets: Sequence[int]) -> Dict[int, int]:
+    """Map UTF-8 byte offsets (on character starts) to str offsets with one forward pass."""
+    if len(data) == len(text):
+        return {b: b for b in byte_offsets}
+    out: Dict[int, int] = {}
+    prev_b = prev_c = 0
+    for b in sorted(set(byte_offsets)):
+        prev_c += len(data[prev_b:b].decode("utf-8"))
+        prev_b = b
+        out[b] = prev_c
+    return out
+
+
+def chunk_spans(text: str, max_tokens: int = 800, overlap: int = 100, model: str = "cl100k_base") -> List[Tuple[int, int, int]]:
+    """Token windows as (start, end, n_tokens) character spans over `text`.
+
+    The text is encoded once and token boundaries are mapped back to offsets, so chunks are
+    plain slices (no per-window decode, no copies until sliced). A boundary that falls inside
+    a multi-byte character is widened to keep the whole character.
+    """
     if not text:
         return []
     if max_tokens <= 0:
-        return [text]
-    if tiktoken is not None:
-        try:
-            enc = tiktoken.encoding_for_model(model)
-        except Exception:
-            enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text)
-        chunks = []
-        start = 0
-        step = max(1, max_tokens - max(0, overlap))
-        while start < len(tokens):
-            end = min(len(tokens), start + max_tokens)
-            chunks.append(enc.decode(tokens[start:end]))
-            start += step
-        return chunks
+        return [(0, len(text), count_tokens(text, model))]
+    enc = get_encoder(model)
+    if enc is not None:
+        tokens = enc.encode_ordinary(text)
+        ends = list(accumulate(len(b) for b in enc.decode_tokens_bytes(tokens)))
+        data = text.encode("utf-8")
+        windows = _token_windows(len(tokens), max_tokens, overlap)
+
+        def char_start(b: int) -> int:
+            while b > 0 and (data[b] & 0xC0) == 0x80:
+                b -= 1
+            return b
+
+        def char_end(b: int) -> int:
+            while b < len(data) and (data[b] & 0xC0) == 0x80:
+                b += 1
+            return b
+
+        byte_spans = [(char_start(ends[s - 1] if s else 0), char_end(ends[e - 1])) for s, e in windows]
+        offs = _byte_to_char_offsets(text, data, [b for span in byte_spans for b in span])
+        return [(offs[bs], offs[be], e - s) for (bs, be), (s, e) in zip(byte_spans, windows)]
     # naive fallback by words
-    words = text.split()
+    words = [m.span() for m in re.finditer(r"\S+", text)]
     approx_ratio = 0.75  # ~tokens/words
     max_words = max(1, int(max_tokens / approx_ratio))
     overlap_words = max(0, int(max(0, overlap) / approx_ratio))
-    chunks = []
-    start = 0
-    step = max(1, max_words - overlap_words)
-    while start < len(words):
-        end = min(len(words), start + max_words)
-        chunks.append(" ".join(words[start:end]))
-        start += step
-    return chunks
+    return [
+        (words[s][0], words[e - 1][1], max(1, int((e - s) * approx_ratio)))
+        for s, e in _token_windows(len(words), max_words, overlap_words)
+    ]
+
+
+def chunk_text(text: str, max_tokens: int = 800, overlap: int = 100, model: str = "cl100k_base") -> List[str]:
+    if not text:
+        return []
+    if max_tokens <= 0:
+        return [text]
+    return [text[s:e] for s, e, _ in chunk_spans(text, max_tokens, overlap, model)]
@@ -0,0 +1,194 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, List, Optional
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+
+CHUNK_SIZE = 1 << 20
+
+# Blobs live under UPLOAD_DIR/_objects/<sha256>; public names are links to them
+OBJECTS_DIR = "_objects"
+INCOMING_DIR = "_incoming"
+# Extracted text: UPLOAD_DIR/_text/<id>.txt plus a page index <id>.json
+TEXT_DIR = "_text"
+
+_DOC_ID_RX = re.compile(r"^[0-9a-f]{32}$")
+
+# Paths under UPLOAD_DIR whose bytes are fixed by their name (see content_etag)
+_CONTENT_PATH_RXS = (
+    re.compile(r"^([0-9a-f]{16})_[^/]+$"),
+    re.compile(r"^" + OBJECTS_DIR + r"/([0-9a-f]{64})$"),
+    re.compile(r"^" + TEXT_DIR + r"/([0-9a-f]{32}\.(?:txt|json))$"),
+)
+
+
+@dataclass
+class StoredUpload:
+    name: str  # public file name under UPLOAD_DIR (served by /files/<name>)
+    path: str  # absolute path of the content blob
+    sha256: str
+    size: int
+    deduplicated: bool  # True when identical content was already stored
+
+
+def _link(src: str, dst: str):
+    """Hard link dst -> src (free, survives blob renames); symlink, then copy, as fallbacks."""
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    import shutil
+
+    shutil.copyfile(src, dst)
+
+
+def store_upload(stream: BinaryIO, upload_dir: str, filename: str, chunk_size: int = CHUNK_SIZE) -> StoredUpload:
+    """Stream an uploaded file to disk in fixed-size chunks while hashing it.
+
+    The bytes land in a temp file next to the object store and are renamed to
+    `_objects/<sha256>` (or dropped if that blob already exists). The returned name,
+    `<sha256[:16]>_<filename>`, is a link to the blob, so re-uploading the same file under
+    the same name reuses everything and a different name costs only a directory entry.
+    `filename` must already be sanitized.
+    """
+    objects = os.path.join(upload_dir, OBJECTS_DIR)
+    incoming = os.path.join(upload_dir, INCOMING_DIR)
+    os.makedirs(objects, exist_ok=True)
+    os.makedirs(incoming, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=incoming)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        blob = os.path.join(objects, digest)
+        deduplicated = os.path.exists(blob)
+        if deduplicated:
+            os.unlink(tmp)
+        else:
+            os.chmod(tmp, 0o644)
+            # Atomic; a concurrent upload of the same bytes just replaces identical content
+            os.replace(tmp, blob)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    name = f"{digest[:16]}_{filename or 'file'}"
+    public = os.path.join(upload_dir, name)
+    if not os.path.exists(public):
+        try:
+            _link(blob, public)
+        except FileExistsError:
+            pass  # another worker linked the same content first
+    return StoredUpload(name=name, path=blob, sha256=digest, size=size, deduplicated=deduplicated)
+
+
+def content_etag(name: str) -> Optional[str]:
+    """ETag for a content-addressed path relative to UPLOAD_DIR (stored uploads, blobs,
+    extracted text), or None for anything else. Such paths never change, so responses for
+    them can be cached as immutable."""
+    for rx in _CONTENT_PATH_RXS:
+        m = rx.match(name or "")
+        if m:
+            return "sha256-" + m.group(1)
+    return None
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def store_text(upload_dir: str, text: str, pages: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Persist an upload's extracted text for lazy page fetches.
+
+    With `pages` ([{page, text}]) the stored document is the "[Sida N]"-marked text /upload
+    returns; otherwise `text` is one page. Returns {id, bytes, pages: [{page, offset, length}]}
+    where offset/length locate each page's text (UTF-8 bytes, without its marker) in
+    `_text/<id>.txt`. The id is derived from the content, so identical text is stored once.
+    """
+    parts: List[bytes] = []
+    index: List[Dict[str, int]] = []
+    pos = 0
+    if pages:
+        for i, p in enumerate(pages):
+            head = ("\n\n" if i else "") + f"[Sida {p.get('page')}]\n"
+            body = (p.get("text") or "").encode("utf-8")
+            pos += len(head.encode("utf-8"))
+            parts += [head.encode("utf-8"), body]
+            index.append({"page": int(p.get("page") or i + 1), "offset": pos, "length": len(body)})
+            pos += len(body)
+    else:
+        body = (text or "").encode("utf-8")
+        parts.append(body)
+        index.append({"page": 1, "offset": 0, "length": len(body)})
+        pos = len(body)
+    data = b"".join(parts)
+    doc_id = hashlib.sha256(data).hexdigest()[:32]
+    folder = os.path.join(upload_dir, TEXT_DIR)
+    os.makedirs(folder, exist_ok=True)
+    base = os.path.join(folder, doc_id)
+    if not os.path.exists(base + ".json"):
+        # Text first: the index appearing is what marks the document as complete
+        _write_atomic(base + ".txt", data)
+        _write_atomic(base + ".json", json.dumps(index, separators=(",", ":")).encode("utf-8"))
+    return {"id": doc_id, "bytes": pos, "pages": index}
+
+
+def read_text_pages(
+    upload_dir: str, doc_id: str, first: Optional[int] = None, last: Optional[int] = None
+) -> Dict[str, Any]:
+    """Pages `first`..`last` (page numbers, inclusive; None = open end) of a stored text.
+
+    Only the requested byte ranges are read. Raises KeyError for unknown ids.
+    """
+    if not _DOC_ID_RX.match(doc_id or ""):
+        raise KeyError(doc_id)
+    base = os.path.join(upload_dir, TEXT_DIR, doc_id)
+    try:
+        with open(base + ".json", "rb") as fh:
+            index = json.loads(fh.read())
+    except FileNotFoundError:
+        raise KeyError(doc_id)
+    selected = [
+        e for e in index if (first is None or e["page"] >= first) and (last is None or e["page"] <= last)
+    ]
+    out = []
+    with open(base + ".txt", "rb") as fh:
+        for e in selected:
+            fh.seek(e["offset"])
+            out.append({"page": e["page"], "text": fh.read(e["length"]).decode("utf-8", errors="replace")})
+    return {"id": doc_id, "pageCount": len(index), "pages": out}
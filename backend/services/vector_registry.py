@@ -1,28 +1,40 @@
 from __future__ import annotations
-from typing import Dict
+from typing import Dict, Optional
+import os
+import threading
 from .vector_store import InMemoryVectorStore
 
 _stores: Dict[str, InMemoryVectorStore] = {}
 _dims: Dict[str, int] = {}
+# Ingest jobs and requests create and reset collections concurrently
+_lock = threading.Lock()
 
 
-def get_store(name: str, dim: int) -> InMemoryVectorStore:
-    store = _stores.get(name)
-    if store is None:
-        store = InMemoryVectorStore(dim=dim)
-        _stores[name] = store
-        _dims[name] = dim
+def get_store(name: str, dim: int, storage: Optional[str] = None) -> InMemoryVectorStore:
+    """Collection store; `storage` (or VECTOR_STORE_DTYPE) only applies when it is created."""
+    with _lock:
+        store = _stores.get(name)
+        if store is None:
+            storage = storage or os.getenv("VECTOR_STORE_DTYPE") or "float32"
+            store = InMemoryVectorStore(dim=dim, storage=storage)
+            _stores[name] = store
+            _dims[name] = dim
+            return store
+        prev = _dims.get(name)
+        if prev is not None and prev != dim:
+            # Dimension changed → reset for simplicity
+            store.reset(dim)
+            _dims[name] = dim
         return store
-    prev = _dims.get(name)
-    if prev is not None and prev != dim:
-        # Dimension changed → reset for simplicity
-        store.clear()
-        store.dim = dim
-        _dims[name] = dim
-    return store
+
+
+def get_dim(name: str) -> Optional[int]:
+    """Vector size a collection was built with (None if it doesn't exist yet)."""
+    return _dims.get(name)
 
 
 def clear_store(name: str):
-    s = _stores.get(name)
+    with _lock:
+        s = _stores.get(name)
     if s:
         s.clear()
\ No newline at end of file
@@ -1,7 +1,19 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import math
+import threading
+
+from .embeddings import truncate_embedding
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover
+    np = None  # type: ignore
+
+
+# Storage modes for InMemoryVectorStore; quantized modes need NumPy
+STORAGE_DTYPES = ("float32", "float16", "int8")
 
 
 def _cosine(a: List[float], b: List[float]) -> float:
@@ -15,8 +27,18 @@ def _cosine(a: List[float], b: List[float]) -> float:
     return dot / (na * nb)
 
 
+def _quantize_int8(v: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Symmetric per-row int8 quantization of a 2-D array: v ~= codes * scale[:, None]."""
+    peak = np.abs(v).max(axis=1) if v.size else np.zeros(v.shape[0], dtype=np.float32)
+    scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+    return np.clip(np.rint(v / scale[:, None]), -127, 127).astype(np.int8), scale
+
+
 @dataclass
 class VectorDoc:
+    """A stored chunk. Docs returned by InMemoryVectorStore queries carry `embedding=[]` when
+    NumPy is available: the vector lives only in the store's matrix (possibly quantized)."""
+
     id: str
     text: str
     embedding: List[float]
@@ -24,25 +46,170 @@ class VectorDoc:
 
 
 class InMemoryVectorStore:
-    def __init__(self, dim: int):
+    """Brute-force cosine store. `dim` may be a reduced (Matryoshka) size: longer embeddings
+    from the same model are truncated on upsert/query instead of rejected.
+
+    With NumPy, embeddings are unit-normalized on upsert into one contiguous matrix (grown
+    geometrically, so appends are amortized O(1)) and are not kept as float lists: docs
+    returned by queries carry an empty `embedding`, so callers that need the vector must keep
+    their own copy. A query is a single matrix product plus argpartition for the top k; `query_many`
+    scores a batch of queries in one pass. `storage="float16"` or `"int8"` (int8 with a
+    per-row scale) shrinks the matrix: rows are widened to float32 in blocks and scored
+    against the float32 query, so scores carry the rows' rounding error only (no float32
+    originals are kept to rescore with). Without NumPy, documents keep their float lists
+    and are scanned in Python.
+    """
+
+    # Rows converted to float32 per matmul block, bounds scratch memory for quantized scans
+    BLOCK_ROWS = 4096
+    MIN_CAPACITY = 64
+    GROWTH = 1.5
+
+    def __init__(self, dim: int, storage: str = "float32"):
+        storage = (storage or "float32").strip().lower()
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported vector storage: {storage}")
         self.dim = dim
+        self.storage = storage if np is not None else "float32"
         self._docs: List[VectorDoc] = []
+        self._index: Dict[str, int] = {}
+        # Guards the matrix, docs and index: background ingest jobs upsert while requests query
+        self._lock = threading.Lock()
+        # Rows 0..len(_docs)-1 are live; the rest is spare capacity
+        self._matrix = None
+        self._scales = None
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage != "float32"
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _reserve(self, n: int):
+        cap = 0 if self._matrix is None else self._matrix.shape[0]
+        if n <= cap:
+            return
+        new_cap = max(n, self.MIN_CAPACITY, int(cap * self.GROWTH))
+        mat = np.zeros((new_cap, self.dim), dtype=np.dtype(self.storage))
+        scales = np.ones(new_cap, dtype=np.float32)
+        live = len(self._docs)
+        if live:
+            mat[:live] = self._matrix[:live]
+            scales[:live] = self._scales[:live]
+        self._matrix, self._scales = mat, scales
+
+    def _normalized(self, vectors: List[List[float]]) -> "np.ndarray":
+        m = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.dim)
+        norms = np.linalg.norm(m, axis=1)
+        np.divide(m, norms[:, None], out=m, where=norms[:, None] > 0)
+        return m
+
+    def _encode(self, m: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """Unit rows -> (rows at storage precision, per-row scales)."""
+        if self.storage == "int8":
+            return _quantize_int8(m)
+        return m.astype(self.storage, copy=False), np.ones(m.shape[0], dtype=np.float32)
 
     def upsert(self, docs: List[VectorDoc]):
-        existing = {d.id: i for i, d in enumerate(self._docs)}
+        """Insert or replace docs by id. The caller's VectorDoc objects are not modified; the
+        store keeps its own copies (without the float list when the matrix holds the vector)."""
+        fitted = []
         for d in docs:
-            if len(d.embedding) != self.dim:
+            emb = d.embedding if len(d.embedding) <= self.dim else truncate_embedding(d.embedding, self.dim)
+            if len(emb) != self.dim:
                 raise ValueError("Embedding dimension mismatch")
-            idx = existing.get(d.id)
-            if idx is None:
-                self._docs.append(d)
-            else:
-                self._docs[idx] = d
+            fitted.append((d, emb))
+        if np is None:
+            with self._lock:
+                for d, emb in fitted:
+                    self._put(VectorDoc(id=d.id, text=d.text, embedding=list(emb), meta=d.meta))
+            return
+        # Last write wins for ids repeated within the batch
+        latest = list({d.id: (d, emb) for d, emb in fitted}.values())
+        if not latest:
+            return
+        rows, scales = self._encode(self._normalized([emb for _, emb in latest]))
+        with self._lock:
+            self._reserve(len(self._docs) + len(latest))
+            slots = np.asarray([self._put(VectorDoc(id=d.id, text=d.text, embedding=[], meta=d.meta)) for d, _ in latest])
+            self._matrix[slots] = rows
+            self._scales[slots] = scales
+
+    def _put(self, doc: VectorDoc) -> int:
+        idx = self._index.get(doc.id)
+        if idx is None:
+            idx = self._index[doc.id] = len(self._docs)
+            self._docs.append(doc)
+        else:
+            self._docs[idx] = doc
+        return idx
+
+    def _scores(self, q: "np.ndarray") -> "np.ndarray":
+        """(n_docs, n_queries) scores of every live row against unit queries `q`."""
+        n = len(self._docs)
+        mat = self._matrix[:n]
+        if not self.quantized:
+            return mat @ q.T
+        qt = q.T
+        out = np.empty((n, q.shape[0]), dtype=np.float32)
+        for start in range(0, n, self.BLOCK_ROWS):
+            stop = min(n, start + self.BLOCK_ROWS)
+            out[start:stop] = mat[start:stop].astype(np.float32) @ qt
+        if self.storage == "int8":
+            out *= self._scales[:n, None]
+        return out
 
     def query(self, embedding: List[float], top_k: int = 5) -> List[Tuple[VectorDoc, float]]:
+        return self.query_many([embedding], top_k)[0]
+
+    def query_many(self, embeddings: List[List[float]], top_k: int = 5) -> List[List[Tuple[VectorDoc, float]]]:
+        """Top-k (doc, cosine) per query, best first; equal scores are listed in insertion order."""
+        embeddings = [e if len(e) <= self.dim else truncate_embedding(e, self.dim) for e in embeddings]
+        if np is None:
+            with self._lock:
+                return [self._query_python(e, top_k) for e in embeddings]
+        valid = [len(e) == self.dim for e in embeddings]
+        q = self._normalized([e if ok else [0.0] * self.dim for e, ok in zip(embeddings, valid)])
+        with self._lock:
+            return self._top_k(q, valid, top_k)
+
+    def _top_k(self, q: "np.ndarray", valid: List[bool], top_k: int) -> List[List[Tuple[VectorDoc, float]]]:
+        n = len(self._docs)
+        if not n or not valid:
+            return [[] for _ in valid]
+        k = min(n, max(1, top_k))
+        scores = self._scores(q)
+        out: List[List[Tuple[VectorDoc, float]]] = []
+        for j, ok in enumerate(valid):
+            if not ok:
+                out.append([(d, 0.0) for d in self._docs[:k]])
+                continue
+            col = scores[:, j]
+            cand = np.sort(np.argpartition(-col, k - 1)[:k]) if k < n else np.arange(n)
+            top = col[cand]
+            # Stable on the ascending candidates: equal scores keep insertion order
+            order = np.argsort(-top, kind="stable")
+            out.append([(self._docs[int(cand[i])], float(top[i])) for i in order])
+        return out
+
+    def _query_python(self, embedding: List[float], top_k: int) -> List[Tuple[VectorDoc, float]]:
         scores = [(_cosine(embedding, d.embedding), d) for d in self._docs]
         scores.sort(key=lambda t: t[0], reverse=True)
         return [(d, s) for s, d in scores[: max(1, top_k)]]
 
+    def reset(self, dim: int):
+        """Drop every document and switch to vectors of size `dim`."""
+        with self._lock:
+            self._clear()
+            self.dim = dim
+
     def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
         self._docs.clear()
+        self._index.clear()
+        self._matrix = None
+        self._scales = None